@@ -0,0 +1,71 @@
+import numpy as np
+from loguru import logger
+
+from indicators import IndicatorCarry, calculate_indicator_series
+from candle import CandleBatch
+
+
+class BackfillIndicatorStage:
+    """
+    Computes indicators for backfilled pages as one contiguous series per stream.
+
+    Pages arrive from concurrent fetch workers in any order. They are held until
+    every earlier window of the same stream is in, and each contiguous run is
+    then computed in one vectorized pass that carries its state into the next run.
+    """
+
+    def __init__(self):
+        self.carries = {}
+        self.next_index = {}
+        self.pending = {}
+
+    def seed(self, symbol, timeframe, candles):
+        """Prime a stream with stored (start_ms, open, high, low, close, volume) candles that precede its first window."""
+        if not candles:
+            return
+        carry = self.carries.setdefault((symbol, timeframe), IndicatorCarry())
+        _, _, highs, lows, closes, _ = zip(*candles)
+        calculate_indicator_series(highs, lows, closes, carry)
+        logger.debug(f"Seeded backfill indicators for {symbol} {timeframe} with {len(candles)} stored candles")
+
+    def window(self, symbol, timeframe, klines, start_ms):
+        """
+        Compute a standalone window (e.g. a gap repair) whose klines begin with the history before it.
+
+        The candles opening before `start_ms` only warm up a fresh indicator state and are not returned.
+
+        Returns:
+            CandleBatch: The candles from `start_ms` on with indicators, or None if there are none.
+        """
+        if not len(klines):
+            return None
+        values = calculate_indicator_series(klines['high'], klines['low'], klines['close'], IndicatorCarry())
+        keep = klines['start'] >= start_ms
+        if not keep.any():
+            return None
+        return CandleBatch.from_klines(symbol, timeframe, klines[keep], {name: column[keep] for name, column in values.items()})
+
+    def submit(self, symbol, timeframe, index, klines):
+        """
+        Hand in the (oldest first) `decoding.KLINE_DTYPE` klines of window `index`, which may be empty.
+
+        Returns:
+            CandleBatch: Candles with indicators for every window that became contiguous, or None.
+        """
+        stream = (symbol, timeframe)
+        pending = self.pending.setdefault(stream, {})
+        pending[index] = klines
+
+        ready = []
+        next_index = self.next_index.get(stream, 0)
+        while next_index in pending:
+            ready.append(pending.pop(next_index))
+            next_index += 1
+        self.next_index[stream] = next_index
+        ready = np.concatenate(ready) if ready else ready
+        if not len(ready):
+            return None
+
+        carry = self.carries.setdefault(stream, IndicatorCarry())
+        values = calculate_indicator_series(ready['high'], ready['low'], ready['close'], carry)
+        return CandleBatch.from_klines(symbol, timeframe, ready, values)
@@ -0,0 +1,437 @@
+import asyncio
+import datetime
+import time
+import aiohttp
+from loguru import logger
+from rich.progress import Progress
+from supabase import create_client
+
+from backfill_indicators import BackfillIndicatorStage
+from candle_cache import WriteThroughCacheWriter, create_candle_cache
+from checkpoint_journal import create_checkpoint_journal, merge_ranges
+from data_fetcher import create_schema, fetch_klines
+from decoding import decode_kline_rows
+from metrics import RATE_LIMIT_WAIT_SECONDS, RATE_LIMIT_WAITS
+from resampler import BASE_TIMEFRAME, BackfillResampler, derived_timeframes
+from storage import BatchingWriter, create_writer, fetch_recent_candles
+from streaming_indicators import WARMUP_CANDLES
+from timeframes import MAX_KLINES_PER_REQUEST, add_candles, align_open, normalize_timeframe, plan_kline_windows, to_ms
+
+
+def _countdown(callback, count):
+    """Return a callable that runs `callback` on its `count`-th call."""
+    remaining = [count]
+
+    def done():
+        remaining[0] -= 1
+        if not remaining[0]:
+            callback()
+    return done
+
+
+class TokenBucket:
+    """
+    Async token bucket that keeps REST traffic under Bybit's request limits.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Every
+    request takes one token and callers queue up (FIFO) while the bucket is empty.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.waits = 0
+        self.wait_time = 0.0
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def for_limit(cls, limit, window, burst_fraction=0.2):
+        """
+        Size a bucket so that no `window`-second span can exceed `limit` requests.
+
+        A bucket with capacity C and refill rate r lets through at most
+        C + r * window requests in any window, so the burst allowance is taken
+        off the steady refill rate.
+
+        :param limit: Number of requests allowed per window.
+        :param window: Length of the window in seconds.
+        :param burst_fraction: Share of the limit that may be spent in one burst.
+        """
+        capacity = max(1, int(limit * burst_fraction))
+        rate = (limit - capacity) / window
+        return cls(rate, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                self.waits += 1
+                self.wait_time += wait
+                RATE_LIMIT_WAITS.inc()
+                RATE_LIMIT_WAIT_SECONDS.inc(wait)
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+
+    def penalize(self, seconds):
+        """Drain the bucket so that no request goes out for roughly `seconds`."""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class BackfillScheduler:
+    """
+    Runs many (symbol, timeframe, window) fetch jobs at once on one shared session.
+
+    Fetch workers pull windows from a queue, wait on the token bucket and hand
+    the pages to a bounded write queue. Write workers drain it into a
+    `storage.BatchingWriter`, so database writes overlap with the REST fetches
+    and total time is set by the rate limit rather than by round-trip latency.
+
+    With a `checkpoint_journal.CheckpointJournal`, windows are journaled once
+    their rows are committed and `add_stream` only queues the windows that are
+    not journaled yet. Ranges after the first are separated by stored candles,
+    so their windows are warmed up on their own like `add_windows`.
+
+    Windows skip the shared `kline_cache.KlinePageCache` unless `use_page_cache`
+    is set: a backfill or gap fill reads each page once, while live repairs
+    overlap with the reconnect catch-up and with each other.
+    """
+
+    def __init__(self, config, writer, concurrency=None, write_concurrency=None, rate_limiter=None, max_retries=5, journal=None, use_page_cache=False):
+        self.config = config
+        self.writer = writer
+        self.concurrency = concurrency or config.BACKFILL_CONCURRENCY
+        self.write_concurrency = write_concurrency or config.BACKFILL_WRITE_CONCURRENCY
+        self.rate_limiter = rate_limiter or TokenBucket.for_limit(config.BYBIT_REST_RATE_LIMIT, config.BYBIT_REST_RATE_WINDOW)
+        self.max_retries = max_retries
+        self.journal = journal
+        self.use_page_cache = use_page_cache
+        self.fetch_queue = asyncio.Queue()
+        self.write_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.indicators = BackfillIndicatorStage()
+        # Symbols whose higher timeframes are built from their 1-minute pages
+        self.resamplers = {}
+        # Windows whose rows are committed, per stream
+        self.committed = {}
+        self.derived_index = {}
+        # Windows handed to the indicator stage but not released by it yet, per stream
+        self.unreleased = {}
+        self.released_index = {}
+        self.progress = None
+        self.progress_tasks = {}
+
+    def add_stream(self, symbol, timeframe, start_time, end_time, candles_per_request=MAX_KLINES_PER_REQUEST, skip_finished=True):
+        ranges = [(to_ms(start_time), to_ms(end_time))]
+        if self.journal is not None and skip_finished:
+            ranges = self.journal.remaining(symbol, timeframe, *ranges[0])
+        windows = [plan_kline_windows(timeframe, range_start, range_end, candles_per_request) for range_start, range_end in ranges]
+        # Only the first range continues the seeded indicator series; stored candles sit between the others
+        series = windows[0] if windows else []
+        standalone = [window for range_windows in windows[1:] for window in range_windows]
+        if not series and not standalone:
+            logger.debug(f"Data for {symbol} (timeframe: {timeframe}) is already up to date")
+            return 0
+        if self.progress is not None:
+            self.progress_tasks[(symbol, timeframe)] = self.progress.add_task(f"[green]Fetching {symbol} {timeframe}...", total=len(series) + len(standalone))
+        for index, (window_start, window_end) in enumerate(series):
+            self.fetch_queue.put_nowait((symbol, timeframe, index, window_start, window_end))
+        self._queue_standalone(symbol, timeframe, standalone)
+        logger.debug(f"Queued {len(series) + len(standalone)} windows for {symbol} (timeframe: {timeframe}) from {start_time} to {end_time}")
+        return len(series) + len(standalone)
+
+    def add_resampled_stream(self, symbol, timeframes, start_time, end_time, candles_per_request=MAX_KLINES_PER_REQUEST):
+        """
+        Backfill the 1-minute stream of `symbol` and derive `timeframes` from it instead of fetching them.
+
+        Derived candles that open before `start_time` would miss minutes, so they are skipped.
+        The resampler needs every minute from `start_time` on, so journaled windows are fetched again.
+        """
+        self.resamplers[symbol] = BackfillResampler(timeframes, to_ms(start_time))
+        return self.add_stream(symbol, BASE_TIMEFRAME, start_time, end_time, candles_per_request, skip_finished=False)
+
+    def add_windows(self, symbol, timeframe, windows):
+        """
+        Queue arbitrary, non-contiguous request windows (e.g. gap repairs) for a stream.
+
+        The windows are not contiguous, so each one is fetched together with the
+        `WARMUP_CANDLES` candles before it and gets its indicators from a fresh
+        state warmed up on them. Only the window's own candles are written.
+        """
+        if not windows:
+            return 0
+        if self.progress is not None:
+            self.progress_tasks[(symbol, timeframe)] = self.progress.add_task(f"[green]Filling gaps in {symbol} {timeframe}...", total=len(windows))
+        self._queue_standalone(symbol, timeframe, windows)
+        logger.debug(f"Queued {len(windows)} windows for {symbol} (timeframe: {timeframe})")
+        return len(windows)
+
+    def _queue_standalone(self, symbol, timeframe, windows):
+        # No index: the window is fetched with its own warmup history instead of joining the stream's series
+        for window_start, window_end in windows:
+            self.fetch_queue.put_nowait((symbol, timeframe, None, window_start, window_end))
+
+    def _advance(self, symbol, timeframe):
+        task = self.progress_tasks.get((symbol, timeframe))
+        if task is not None:
+            self.progress.update(task, advance=1)
+
+    async def _fetch_window(self, session, symbol, timeframe, window_start, window_end):
+        for attempt in range(self.max_retries):
+            try:
+                klines = await fetch_klines(
+                    session, symbol, timeframe, window_start, window_end, self.config,
+                    rate_limiter=self.rate_limiter, use_cache=self.use_page_cache,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Request for {symbol} {timeframe} {window_start} failed: {e}")
+                klines = decode_kline_rows([])
+            if klines is not None:
+                return klines
+            await asyncio.sleep(min(2 ** attempt, 30))
+        logger.error(f"Giving up on {symbol} {timeframe} window {window_start} - {window_end} after {self.max_retries} attempts")
+        return None
+
+    async def _fetch_worker(self, session):
+        while True:
+            symbol, timeframe, index, window_start, window_end = await self.fetch_queue.get()
+            fetch_start = window_start
+            if index is None:
+                fetch_start = add_candles(window_start, timeframe, -WARMUP_CANDLES)
+            try:
+                try:
+                    klines = await self._fetch_window(session, symbol, timeframe, fetch_start, window_end)
+                except Exception as e:
+                    logger.error(f"Error fetching {symbol} {timeframe} window {window_start} - {window_end}: {e}")
+                    klines = None
+                if klines is not None and not len(klines):
+                    logger.warning(f"No klines fetched for the period from {window_start} to {window_end} for {symbol} {timeframe}")
+                # Empty and failed (None) windows still go through so the indicator stage can move past them
+                await self.write_queue.put((symbol, timeframe, index, window_start, window_end, klines))
+            finally:
+                self.fetch_queue.task_done()
+
+    async def _write_worker(self):
+        while True:
+            symbol, timeframe, index, window_start, window_end, klines = await self.write_queue.get()
+            try:
+                # A failed window is not journaled, so the next run fetches it again
+                window = (window_start, window_end) if klines is not None else None
+                if klines is None:
+                    klines = decode_kline_rows([])
+                if index is None:
+                    batch = self.indicators.window(symbol, timeframe, klines, window_start)
+                    finished = [window] if window is not None else []
+                else:
+                    batch = self.indicators.submit(symbol, timeframe, index, klines)
+                    finished = self._release(symbol, timeframe, index, window)
+                # Resample before the next await so pages reach the resampler in the order the stage released them
+                derived = self._resample(symbol, timeframe, batch)
+                batches = ([batch] if batch is not None and len(batch) else []) + derived
+                checkpoint = self._checkpoint(symbol, timeframe, finished)
+                if not batches and checkpoint is not None:
+                    checkpoint()
+                # The windows are journaled once every one of their batches is written, whichever flush carries it
+                on_commit = _countdown(checkpoint, len(batches)) if batches and checkpoint is not None else None
+                for item in batches:
+                    await self.writer.add(item, on_commit=on_commit)
+                if batch is not None and len(batch):
+                    logger.debug("Queued {} klines for {} {} up to window {} - {}", len(batch), symbol, timeframe, window_start, window_end)
+            except Exception as e:
+                logger.error(f"Error writing {symbol} {timeframe} window {window_start} - {window_end}: {e}")
+            finally:
+                self._advance(symbol, timeframe)
+                self.write_queue.task_done()
+
+    def _release(self, symbol, timeframe, index, window):
+        """Track the windows the indicator stage holds back; returns those it released with window `index`."""
+        stream = (symbol, timeframe)
+        pending = self.unreleased.setdefault(stream, {})
+        pending[index] = window
+        released = []
+        next_index = self.released_index.get(stream, 0)
+        while next_index in pending:
+            window = pending.pop(next_index)
+            if window is not None:
+                released.append(window)
+            next_index += 1
+        self.released_index[stream] = next_index
+        return released
+
+    def _checkpoint(self, symbol, timeframe, windows):
+        """Return a callable that marks `windows` committed and journals them, or None when there are none."""
+        if not windows:
+            return None
+        # The candle still in progress is fetched again on the next run
+        open_ms = align_open(int(time.time() * 1000), timeframe)
+        ranges = [(start, min(end, open_ms - 1)) for start, end in windows if start < open_ms]
+
+        def checkpoint():
+            self.committed.setdefault((symbol, timeframe), []).extend(windows)
+            if self.journal is not None and ranges:
+                self.journal.record(symbol, timeframe, ranges)
+        return checkpoint
+
+    def committed_through(self, symbol, timeframe, start_ms):
+        """Return the last epoch ms of the unbroken run of committed windows that covers `start_ms`, or None."""
+        for run_start, run_end in merge_ranges(self.committed.get((symbol, timeframe), [])):
+            if run_start <= start_ms <= run_end:
+                return run_end
+        return None
+
+    def _derive(self, symbol, candles_by_timeframe):
+        batches = []
+        for timeframe, klines in candles_by_timeframe.items():
+            if not len(klines):
+                continue
+            index = self.derived_index.get((symbol, timeframe), 0)
+            self.derived_index[(symbol, timeframe)] = index + 1
+            batch = self.indicators.submit(symbol, timeframe, index, klines)
+            if batch is not None and len(batch):
+                batches.append(batch)
+        return batches
+
+    def _resample(self, symbol, timeframe, batch):
+        resampler = self.resamplers.get(symbol)
+        if resampler is None or timeframe != BASE_TIMEFRAME or batch is None:
+            return []
+        return self._derive(symbol, resampler.feed(batch.array))
+
+    async def run(self, session):
+        """Process every queued window and return once all pages are written."""
+        workers = [asyncio.create_task(self._fetch_worker(session)) for _ in range(self.concurrency)]
+        workers += [asyncio.create_task(self._write_worker()) for _ in range(self.write_concurrency)]
+        try:
+            await self.fetch_queue.join()
+            await self.write_queue.join()
+            for symbol, resampler in self.resamplers.items():
+                # The newest bucket of each derived timeframe is the candle still in progress
+                for batch in self._derive(symbol, resampler.finish()):
+                    await self.writer.add(batch)
+            await self.writer.flush()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logger.debug(f"Backfill finished. Rate limiter waited {self.rate_limiter.waits} times ({self.rate_limiter.wait_time:.1f}s)")
+
+
+def get_resume_time(supabase, symbol, timeframe, start_time, cache=None, journal=None):
+    """
+    Return the open time (epoch ms) of the first candle that is not stored yet.
+
+    A stream with checkpoints in `journal` is answered from there. Otherwise the
+    local cache and then the database are asked, and the stored range is
+    journaled so later runs need no probe.
+    """
+    if journal is not None and journal.has_stream(symbol, timeframe):
+        resume_time = journal.resume_time(symbol, timeframe, to_ms(start_time))
+        logger.debug(f"Found checkpoints for {symbol} {timeframe}. Resuming at {datetime.datetime.fromtimestamp(resume_time / 1000)}")
+        return resume_time
+    resume_time = _probe_resume_time(supabase, symbol, timeframe, start_time, cache)
+    if journal is not None and resume_time > to_ms(start_time):
+        journal.record(symbol, timeframe, [(to_ms(start_time), resume_time - 1)])
+    return resume_time
+
+
+def _probe_resume_time(supabase, symbol, timeframe, start_time, cache=None):
+    latest_cached = cache.latest(symbol, timeframe) if cache is not None else None
+    if latest_cached is not None:
+        logger.debug(f"Found cached data for {symbol} {timeframe}. Resuming after {datetime.datetime.fromtimestamp(latest_cached / 1000)}")
+        return add_candles(latest_cached, timeframe, 1)
+    existing_data_response = supabase.table('candles').select('datetime').eq('symbol', symbol).eq('timeframe', timeframe).order('datetime', desc=True).limit(1).execute()
+    existing_data = existing_data_response.data
+    if existing_data:
+        latest_datetime = datetime.datetime.fromisoformat(existing_data[0]['datetime'])
+        logger.debug(f"Found existing data for {symbol} {timeframe}. Resuming after {latest_datetime}")
+        return add_candles(to_ms(latest_datetime), timeframe, 1)
+    logger.debug(f"No existing data found for {symbol} {timeframe}. Fetching from {start_time}")
+    return to_ms(start_time)
+
+
+def seed_indicators(scheduler, supabase, symbol, timeframe, cache=None, before_ms=None):
+    """Prime the indicator stage of a stream with the newest stored candles (only those opening before `before_ms` when given)."""
+    stored = cache.recent(symbol, timeframe, WARMUP_CANDLES, before_ms) if cache is not None else []
+    stored = stored or fetch_recent_candles(supabase, symbol, timeframe, WARMUP_CANDLES, before_ms)
+    scheduler.indicators.seed(symbol, timeframe, stored)
+
+
+def queue_resampled_backfill(scheduler, supabase, symbol, timeframes, start_time, end_time, batch_size, cache=None):
+    """
+    Queue one 1-minute backfill for `symbol` that also produces its other timeframes.
+
+    The fetch starts at the earliest resume point of all the timeframes, moved
+    back to the open of the candle containing it in every timeframe, so each
+    derived candle from there on is built from complete minutes.
+    """
+    timeframes = [BASE_TIMEFRAME] + derived_timeframes(timeframes)
+    journal = scheduler.journal
+    if journal is not None and journal.has_stream(symbol, BASE_TIMEFRAME):
+        # Derived candles are journaled through the 1-minute windows they are built from
+        resume_time = journal.resume_time(symbol, BASE_TIMEFRAME, to_ms(start_time))
+    else:
+        resume_time = min(_probe_resume_time(supabase, symbol, timeframe, start_time, cache) for timeframe in timeframes)
+    resume_time = min(align_open(resume_time, timeframe) for timeframe in timeframes)
+    if journal is not None and resume_time > to_ms(start_time):
+        journal.record(symbol, BASE_TIMEFRAME, [(to_ms(start_time), resume_time - 1)])
+    if resume_time > to_ms(start_time):
+        for timeframe in timeframes:
+            seed_indicators(scheduler, supabase, symbol, timeframe, cache, align_open(resume_time, timeframe))
+    scheduler.add_resampled_stream(symbol, timeframes, resume_time, end_time, batch_size)
+
+
+async def run_backfill(symbols, timeframes, start_date, config, batch_size=MAX_KLINES_PER_REQUEST):
+    """
+    Backfill every (symbol, timeframe) pair from `start_date` (or the latest stored candle) up to now.
+
+    Args:
+        symbols (list): Trading symbols (e.g., ["BTCUSDT", "ETHUSDT"]).
+        timeframes (list): Candlestick timeframes (e.g., ["1", "5", "D"]). With RESAMPLE_FROM_1M only
+            the 1-minute series is fetched and the others are built from it.
+        start_date (str): ISO start date used for streams with no stored data.
+        config (Config): Configuration object containing API details.
+        batch_size (int): Candles per REST request (at most 1000).
+    """
+    supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
+    await create_schema(supabase)
+
+    start_time = datetime.datetime.fromisoformat(start_date)
+    end_time = datetime.datetime.now()
+
+    cache = create_candle_cache(config)
+    writer = create_writer(config, supabase)
+    if cache is not None:
+        writer = WriteThroughCacheWriter(writer, cache)
+    writer = BatchingWriter(writer, config.WRITE_BATCH_SIZE, config.LIVE_FLUSH_INTERVAL).start()
+    journal = create_checkpoint_journal(config)
+    try:
+        async with aiohttp.ClientSession() as session:
+            with Progress() as progress:
+                scheduler = BackfillScheduler(config, writer, journal=journal)
+                scheduler.progress = progress
+                for symbol in symbols:
+                    if config.RESAMPLE_FROM_1M and derived_timeframes(timeframes):
+                        queue_resampled_backfill(scheduler, supabase, symbol, timeframes, start_time, end_time, batch_size, cache)
+                        continue
+                    for timeframe in map(normalize_timeframe, timeframes):
+                        resume_time = get_resume_time(supabase, symbol, timeframe, start_time, cache, journal)
+                        if resume_time > to_ms(start_time):
+                            # The journal can trail the stored candles, so seed from those before the resume point only
+                            seed_indicators(scheduler, supabase, symbol, timeframe, cache, resume_time)
+                        scheduler.add_stream(symbol, timeframe, resume_time, end_time, batch_size)
+                await scheduler.run(session)
+    finally:
+        # Committed batches are journaled on the way, so a failed run still resumes from them
+        await writer.close()
+        if journal is not None:
+            journal.close()
+
+    logger.debug("Backfill completed for all symbols and timeframes")
@@ -0,0 +1,254 @@
+"""
+Benchmarks for the backfill, gap-fill and live paths against local stand-ins.
+
+Bybit is replaced by `mock_bybit` (REST pages with configurable latency and
+429 replies, and a WebSocket replayer of captured or synthetic kline streams)
+and the database by SQLite, or by a local Postgres when `--database` is a DSN.
+Nothing touches the exchange or Supabase.
+
+    python src/benchmark.py --modes backfill,gapfill,live --symbols BTCUSDT,ETHUSDT --days 7
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+import aiohttp
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+
+from backfill_scheduler import BackfillScheduler
+from checkpoint_journal import create_checkpoint_journal
+from config import Config
+from log_setup import setup_logger
+from gap_detection import coalesce_gaps, count_missing, find_gaps
+from metrics import COMMIT_LATENCY, REGISTRY, REST_REQUESTS, WRITE_BATCH_ROWS
+from mock_bybit import MockBybitRest, MockBybitWebSocket, load_capture, start_mock_bybit, synthetic_stream
+from resampler import derived_timeframes
+from sharding import ShardCoordinator
+from storage import BatchingWriter, SqliteCandleWriter, create_writer
+from timeframes import normalize_timeframe, to_ms
+from tracing import TRACER
+from websocket_handler import start_websocket_connections
+
+console = Console()
+
+
+def peak_memory_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_config(args, workdir):
+    base_url = f"http://127.0.0.1:{args.port}"
+    return Config(
+        SUPABASE_URL="http://127.0.0.1:9",
+        SUPABASE_SERVICE_KEY="benchmark",
+        BYBIT_API_KEY="",
+        BYBIT_API_SECRET="",
+        BYBIT_REST_URL=base_url,
+        BYBIT_WS_URL=f"ws://127.0.0.1:{args.port}/v5/public/linear",
+        DATABASE_URL=args.database or f"sqlite:///{os.path.join(workdir, 'candles.db')}",
+        CANDLE_CACHE_DIR=None,
+        RING_BUFFER_DIR=os.path.join(workdir, 'ring_buffers'),
+        RESAMPLE_FROM_1M=args.resample,
+        BACKFILL_JOURNAL=os.path.join(workdir, 'backfill_journal.db'),
+    )
+
+
+def span_percentiles(name):
+    p = TRACER.percentiles(name)
+    return f"{p[50] * 1000:.2f} / {p[99] * 1000:.2f}" if p else "-"
+
+
+async def bench_backfill(config, args, rest, mode='backfill'):
+    """Backfill every stream; run again as the "resume" mode, it measures a restart against the checkpoint journal."""
+    writer = BatchingWriter(create_writer(config), config.WRITE_BATCH_SIZE, config.LIVE_FLUSH_INTERVAL).start()
+    journal = create_checkpoint_journal(config)
+    scheduler = BackfillScheduler(config, writer, journal=journal)
+    end_time = datetime.datetime.now()
+    start_time = end_time - datetime.timedelta(days=args.days)
+    for symbol in args.symbols:
+        if config.RESAMPLE_FROM_1M and derived_timeframes(args.timeframes):
+            scheduler.add_resampled_stream(symbol, args.timeframes, start_time, end_time)
+            continue
+        for timeframe in args.timeframes:
+            scheduler.add_stream(symbol, timeframe, start_time, end_time)
+
+    requests_before = rest.requests
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await scheduler.run(session)
+    await writer.close()
+    journal.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': mode,
+        'items': writer.rows_written,
+        'unit': 'candles',
+        'seconds': elapsed,
+        'requests': rest.requests - requests_before,
+        'latency': f"page {span_percentiles('fetch_kline_page')}",
+        'notes': f"{scheduler.rate_limiter.waits} limiter waits ({scheduler.rate_limiter.wait_time:.1f}s), {rest.rejected} x 429",
+    }
+
+
+def punch_holes(path, every=97, width=3):
+    """Delete `width` of every `every` stored candles to give the gap filler work."""
+    with sqlite3.connect(path) as connection:
+        return connection.execute("DELETE FROM candles WHERE rowid % ? < ?", (every, width)).rowcount
+
+
+async def bench_gapfill(config, args, rest):
+    if not config.DATABASE_URL.startswith('sqlite:///'):
+        logger.warning("The gap-fill benchmark needs the SQLite stand-in, skipping it")
+        return None
+    path = config.DATABASE_URL[len('sqlite:///'):]
+    removed = punch_holes(path)
+
+    store = SqliteCandleWriter(path)
+    end_ms = to_ms(datetime.datetime.now())
+    start_ms = end_ms - args.days * 86_400_000
+    writer = BatchingWriter(store, config.WRITE_BATCH_SIZE, config.LIVE_FLUSH_INTERVAL).start()
+    scheduler = BackfillScheduler(config, writer)
+
+    started = time.perf_counter()
+    missing = 0
+    for symbol in args.symbols:
+        for timeframe in args.timeframes:
+            gaps = find_gaps(store.timestamps(symbol, timeframe, start_ms, end_ms), start_ms, end_ms, timeframe)
+            missing += count_missing(gaps)
+            scheduler.add_windows(symbol, timeframe, coalesce_gaps(gaps, timeframe))
+    detected = time.perf_counter() - started
+
+    requests_before = rest.requests
+    async with aiohttp.ClientSession() as session:
+        await scheduler.run(session)
+    # Also closes `store`: the batcher closes the writer it wraps
+    await writer.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': 'gap-fill',
+        'items': missing,
+        'unit': 'candles',
+        'seconds': elapsed,
+        'requests': rest.requests - requests_before,
+        'latency': f"detect {detected * 1000:.0f} ms",
+        'notes': f"{removed} rows removed, {writer.rows_written} rows rewritten",
+    }
+
+
+async def _replayed(ws):
+    # Workers connect one after another, so wait for every message rather than for the open replays
+    while ws.sent < len(ws.messages):
+        await asyncio.sleep(0.05)
+
+
+async def bench_live(config, args, ws):
+    coordinator = None
+    if args.workers > 1:
+        coordinator = ShardCoordinator(args.symbols, args.timeframes, None, config, args.workers, args.log_level, log_file=None).start()
+        live = asyncio.create_task(coordinator.run(dashboard=False))
+        finished = _replayed(ws)
+    else:
+        live = asyncio.create_task(start_websocket_connections(args.symbols, args.timeframes, None, config, dashboard=False))
+        finished = ws.finished.wait()
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(finished, timeout=args.live_timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"The replay did not finish within {args.live_timeout}s")
+    elapsed = time.perf_counter() - started
+    # Let the last batch reach the database before shutting down
+    await asyncio.sleep(config.LIVE_FLUSH_INTERVAL * 2)
+    live.cancel()
+    await asyncio.gather(live, return_exceptions=True)
+    if coordinator is not None:
+        await coordinator.close()
+        # Add the workers' metrics to this process's, for the commit latency below
+        REGISTRY.load([REGISTRY.snapshot(), *coordinator.snapshots.values()])
+    return {
+        'mode': f'live ({args.workers} workers)' if coordinator is not None else 'live',
+        'items': ws.sent,
+        'unit': 'messages',
+        'seconds': elapsed,
+        'requests': None,
+        'latency': f"commit p50 {COMMIT_LATENCY.quantile(0.5) * 1000:.0f} / p99 {COMMIT_LATENCY.quantile(0.99) * 1000:.0f} ms",
+        'notes': f"parse {span_percentiles('parse_kline_message')} ms, indicators {span_percentiles('indicators.apply')} ms (p50 / p99)",
+    }
+
+
+def print_report(results):
+    table = Table(title="Benchmark results")
+    for column in ["Mode", "Items", "Seconds", "Throughput", "REST calls", "Latency", "Peak RSS (MB)", "Notes"]:
+        table.add_column(column)
+    for result in results:
+        table.add_row(
+            result['mode'],
+            f"{result['items']} {result['unit']}",
+            f"{result['seconds']:.2f}",
+            f"{result['items'] / result['seconds']:.0f} {result['unit']}/s" if result['seconds'] else "-",
+            str(result['requests']) if result['requests'] is not None else "-",
+            result['latency'],
+            f"{result['memory']:.0f}",
+            result['notes'],
+        )
+    console.print(table)
+    console.print(f"Write batches: {WRITE_BATCH_ROWS.values.get((), [0])[-1]}, REST outcomes: {dict((key[0], value) for key, value in REST_REQUESTS.values.items())}")
+    console.print(TRACER.summary())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark the reader against local Bybit and database stand-ins')
+    parser.add_argument('--modes', type=str, default='backfill,resume,gapfill,live', help='Comma-separated modes to run: backfill, resume, gapfill, live')
+    parser.add_argument('--symbols', type=str, default='BTCUSDT,ETHUSDT,SOLUSDT,XRPUSDT', help='Comma-separated symbols')
+    parser.add_argument('--timeframes', type=str, default='1,5', help='Comma-separated timeframes')
+    parser.add_argument('--days', type=float, default=7, help='History to backfill and audit, in days')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds the mock REST API waits before answering')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of REST requests answered with HTTP 429')
+    parser.add_argument('--capture', type=str, default=None, help='Replay this capture (see mock_bybit.record_stream) instead of a synthetic stream')
+    parser.add_argument('--candles', type=int, default=30, help='Candles per stream in the synthetic live stream')
+    parser.add_argument('--ticks', type=int, default=20, help='In-progress updates per candle in the synthetic live stream')
+    parser.add_argument('--speed', type=float, default=0, help='Replay speed relative to market time (0: as fast as possible)')
+    parser.add_argument('--live-timeout', type=float, default=300, help='Maximum seconds to wait for the replay to finish')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for the live mode')
+    parser.add_argument('--resample', action='store_true', help='Fetch and stream 1-minute candles only and build the other timeframes from them')
+    parser.add_argument('--database', type=str, default=None, help='Postgres DSN or sqlite:///path (default: a temporary SQLite file)')
+    parser.add_argument('--port', type=int, default=8765, help='Port for the mock Bybit servers')
+    parser.add_argument('--log-level', type=str, default='WARNING', help='Log level')
+    args = parser.parse_args()
+
+    setup_logger(args.log_level, log_file=None)
+    args.symbols = [symbol.strip() for symbol in args.symbols.split(',')]
+    args.timeframes = [normalize_timeframe(tf.strip()) for tf in args.timeframes.split(',')]
+    modes = [mode.strip() for mode in args.modes.split(',')]
+
+    messages = load_capture(args.capture) if args.capture else synthetic_stream(args.symbols, args.timeframes, args.candles, args.ticks)
+    rest = MockBybitRest(args.latency, args.error_rate)
+    ws = MockBybitWebSocket(messages, args.speed)
+    runner = await start_mock_bybit(rest, ws, port=args.port)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config = build_config(args, workdir)
+        try:
+            for mode, bench in [('backfill', lambda: bench_backfill(config, args, rest)),
+                                ('resume', lambda: bench_backfill(config, args, rest, 'resume')),
+                                ('gapfill', lambda: bench_gapfill(config, args, rest)),
+                                ('live', lambda: bench_live(config, args, ws))]:
+                if mode in modes:
+                    result = await bench()
+                    if result is not None:
+                        result['memory'] = peak_memory_mb()
+                        results.append(result)
+        finally:
+            await runner.cleanup()
+    print_report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+import datetime
+import math
+import numpy as np
+
+# Columns written to the candles table, in COPY order
+KEY_COLUMNS = ['symbol', 'timeframe', 'datetime']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+INDICATOR_COLUMNS = [
+    'rsi',
+    'macd_line', 'signal_line', 'macd_histogram',
+    'middle_band', 'upper_band', 'lower_band',
+    'sma',
+    'fib_0_0', 'fib_23_6', 'fib_38_2', 'fib_50_0', 'fib_61_8', 'fib_100_0',
+]
+CANDLE_COLUMNS = KEY_COLUMNS + PRICE_COLUMNS + INDICATOR_COLUMNS
+
+# A candle with its indicators as one fixed-size record; missing indicators are NaN
+CANDLE_DTYPE = np.dtype([('start', 'i8')] + [(column, 'f8') for column in PRICE_COLUMNS + INDICATOR_COLUMNS])
+
+NO_INDICATORS = (math.nan,) * len(INDICATOR_COLUMNS)
+
+
+def nan_to_none(value):
+    """Map missing indicator values (None or NaN) to None so they are stored as NULL."""
+    if value is None or value != value:
+        return None
+    return float(value)
+
+
+class Candle:
+    """
+    One live kline and its indicators in flat slots.
+
+    Replaces the nested `kline_data` dicts: the pipeline stages, the indicator
+    engine, the writer and the dashboard all pass the same object along.
+    """
+
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'timestamp', 'confirmed') + tuple(INDICATOR_COLUMNS)
+
+    def __init__(self, start, open, high, low, close, volume, timestamp=0, confirmed=False):
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.timestamp = timestamp
+        self.confirmed = confirmed
+        self.set_indicators(NO_INDICATORS)
+
+    @classmethod
+    def from_ws(cls, kline):
+        """Build a candle from a raw Bybit WebSocket kline dict."""
+        return cls(
+            int(kline['start']),
+            float(kline['open']),
+            float(kline['high']),
+            float(kline['low']),
+            float(kline['close']),
+            float(kline['volume']),
+            int(kline.get('timestamp') or 0),
+            bool(kline['confirm']),
+        )
+
+    @property
+    def datetime(self):
+        return datetime.datetime.fromtimestamp(self.start // 1000)
+
+    def set_indicators(self, values):
+        """Set the indicators from a tuple in `INDICATOR_COLUMNS` order."""
+        for column, value in zip(INDICATOR_COLUMNS, values):
+            setattr(self, column, value)
+
+    def row(self, symbol, timeframe):
+        """Return the candle as a row dict for the writers."""
+        row = {'symbol': symbol, 'timeframe': timeframe, 'datetime': self.datetime}
+        for column in PRICE_COLUMNS:
+            row[column] = getattr(self, column)
+        for column in INDICATOR_COLUMNS:
+            row[column] = nan_to_none(getattr(self, column))
+        return row
+
+
+class CandleBatch:
+    """
+    Candles of one stream in a `CANDLE_DTYPE` array, ordered oldest first.
+
+    Backfilled pages stay in this form from the indicator stage to the write
+    buffer and are only expanded into row dicts when their batch is written.
+    """
+
+    __slots__ = ('symbol', 'timeframe', 'array', 'with_indicators')
+
+    def __init__(self, symbol, timeframe, array, with_indicators=True):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.array = array
+        # Batches without indicators leave the stored indicator columns alone
+        self.with_indicators = with_indicators
+
+    @classmethod
+    def from_klines(cls, symbol, timeframe, klines, indicators=None):
+        """
+        :param klines: A `decoding.KLINE_DTYPE` array.
+        :param indicators: Optional dict of indicator arrays aligned with `klines`, keyed by column.
+        """
+        array = np.empty(len(klines), dtype=CANDLE_DTYPE)
+        array['start'] = klines['start']
+        for column in PRICE_COLUMNS:
+            array[column] = klines[column]
+        for column in INDICATOR_COLUMNS:
+            array[column] = indicators[column] if indicators is not None and column in indicators else math.nan
+        return cls(symbol, timeframe, array, indicators is not None)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        start, *prices_and_indicators = self.array[index].tolist()
+        candle = Candle(start, *prices_and_indicators[:len(PRICE_COLUMNS)], confirmed=True)
+        candle.set_indicators(prices_and_indicators[len(PRICE_COLUMNS):])
+        return candle
+
+    def rows(self):
+        """Expand the batch into row dicts for the writers in one pass."""
+        symbol, timeframe = self.symbol, self.timeframe
+        price_count = len(PRICE_COLUMNS)
+        rows = []
+        for start, *values in self.array.tolist():
+            row = {'symbol': symbol, 'timeframe': timeframe, 'datetime': datetime.datetime.fromtimestamp(start / 1000)}
+            row.update(zip(PRICE_COLUMNS, values[:price_count]))
+            if self.with_indicators:
+                row.update(zip(INDICATOR_COLUMNS, [None if value != value else value for value in values[price_count:]]))
+            rows.append(row)
+        return rows
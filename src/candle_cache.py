@@ -0,0 +1,238 @@
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+import numpy as np
+from loguru import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # The cache is optional
+    pa = None
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; the index is then saved without a lock
+    fcntl = None
+
+CACHE_COLUMNS = ['ts', 'open', 'high', 'low', 'close', 'volume']
+INDEX_FILE = 'index.json'
+
+
+def _month_key(ts_ms):
+    moment = datetime.datetime.fromtimestamp(ts_ms / 1000, tz=datetime.timezone.utc)
+    return f"{moment.year:04d}-{moment.month:02d}"
+
+
+class CandleCache:
+    """
+    Local on-disk candle store with one Parquet file per symbol, timeframe and month.
+
+    Layout: `<root>/<symbol>/<timeframe>/<YYYY-MM>.parquet`, plus `<root>/index.json`
+    holding the min/max open time (epoch ms) and row count of every partition, so
+    range lookups only open the partitions they need and read them memory-mapped.
+
+    Writing a partition rewrites its whole file, so written rows are buffered
+    per partition. A partition is written once its stream moves on to a later
+    month, once its oldest buffered row has waited `flush_interval` seconds,
+    before any read, and on `flush`. A 1-minute backfill therefore writes each
+    month about once instead of once per batch.
+    """
+
+    def __init__(self, root, flush_interval=60.0):
+        self.root = root
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # partition -> buffered (ts, open, high, low, close, volume) records, and when the first was buffered
+        self._pending = {}
+        self._pending_since = {}
+        os.makedirs(root, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as handle:
+            return json.load(handle)
+
+    def _save_index(self, partitions):
+        path = os.path.join(self.root, INDEX_FILE)
+        with open(path + '.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Workers of a sharded run write their own partitions of the same cache
+            index = self._load_index()
+            index.update({partition: self.index[partition] for partition in partitions})
+            self.index = index
+            with open(path + '.tmp', 'w') as handle:
+                json.dump(self.index, handle)
+            os.replace(path + '.tmp', path)
+
+    def _partition(self, symbol, timeframe, month):
+        return f"{symbol}/{timeframe}/{month}"
+
+    def _path(self, partition):
+        return os.path.join(self.root, partition + '.parquet')
+
+    def partitions(self, symbol, timeframe, start_ms=None, end_ms=None):
+        """Return the index entries of a stream that overlap [start_ms, end_ms], oldest first."""
+        prefix = f"{symbol}/{timeframe}/"
+        with self._lock:
+            # Reads see every written row
+            self._write_partitions([partition for partition in self._pending if partition.startswith(prefix)])
+        entries = []
+        for partition, entry in sorted(self.index.items()):
+            if not partition.startswith(prefix):
+                continue
+            if start_ms is not None and entry['max_ts'] < start_ms:
+                continue
+            if end_ms is not None and entry['min_ts'] > end_ms:
+                continue
+            entries.append((partition, entry))
+        return entries
+
+    def write(self, symbol, timeframe, rows):
+        """
+        Buffer candle rows (dicts with `datetime` and OHLCV keys) for their monthly partitions.
+
+        Rows replace cached candles with the same open time.
+        """
+        if not rows:
+            return
+        with self._lock:
+            now = time.monotonic()
+            months = set()
+            for row in rows:
+                ts = round(row['datetime'].timestamp() * 1000)
+                month = _month_key(ts)
+                months.add(month)
+                partition = self._partition(symbol, timeframe, month)
+                self._pending.setdefault(partition, []).append((ts, row['open'], row['high'], row['low'], row['close'], row['volume']))
+                self._pending_since.setdefault(partition, now)
+            # Months the stream has moved past are not written to again
+            newest = self._partition(symbol, timeframe, max(months))
+            prefix = f"{symbol}/{timeframe}/"
+            due = [
+                partition for partition, since in self._pending_since.items()
+                if (partition.startswith(prefix) and partition < newest) or now - since >= self.flush_interval
+            ]
+            self._write_partitions(due)
+
+    def flush(self):
+        """Write every buffered row to its partition."""
+        with self._lock:
+            self._write_partitions(list(self._pending))
+
+    def _write_partitions(self, partitions):
+        for partition in partitions:
+            records = self._pending.pop(partition)
+            del self._pending_since[partition]
+            path = self._path(partition)
+            ts = np.array([record[0] for record in records], dtype=np.int64)
+            values = np.array([record[1:] for record in records], dtype=float)
+            if os.path.exists(path):
+                existing = pq.read_table(path, memory_map=True)
+                ts = np.concatenate((existing.column('ts').to_numpy(), ts))
+                values = np.concatenate((np.column_stack([existing.column(column).to_numpy() for column in CACHE_COLUMNS[1:]]), values))
+            # Keep the last row for every open time; np.unique also sorts by it
+            _, first_from_end = np.unique(ts[::-1], return_index=True)
+            keep = len(ts) - 1 - first_from_end
+            ts, values = ts[keep], values[keep]
+            table = pa.table({'ts': ts, **{column: values[:, i] for i, column in enumerate(CACHE_COLUMNS[1:])}})
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pq.write_table(table, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            self.index[partition] = {'min_ts': int(ts[0]), 'max_ts': int(ts[-1]), 'rows': len(ts)}
+        if partitions:
+            self._save_index(partitions)
+
+    def read(self, symbol, timeframe, start_ms=None, end_ms=None, columns=None):
+        """Return the cached candles of a stream in [start_ms, end_ms] as a pyarrow Table ordered by `ts`."""
+        columns = columns or CACHE_COLUMNS
+        tables = []
+        for partition, _ in self.partitions(symbol, timeframe, start_ms, end_ms):
+            tables.append(pq.read_table(self._path(partition), columns=columns, memory_map=True))
+        if not tables:
+            return None
+        table = pa.concat_tables(tables)
+        if start_ms is not None or end_ms is not None:
+            ts = table.column('ts')
+            mask = pc.and_(pc.greater_equal(ts, start_ms if start_ms is not None else -2 ** 62),
+                           pc.less_equal(ts, end_ms if end_ms is not None else 2 ** 62))
+            table = table.filter(mask)
+        return table
+
+    def timestamps(self, symbol, timeframe, start_ms=None, end_ms=None):
+        """Return the cached open times of a stream in [start_ms, end_ms] as a sorted int64 array."""
+        table = self.read(symbol, timeframe, start_ms, end_ms, columns=['ts'])
+        if table is None:
+            return np.empty(0, dtype=np.int64)
+        return table.column('ts').to_numpy()
+
+    def latest(self, symbol, timeframe):
+        """Return the newest cached open time (epoch ms) of a stream, or None."""
+        entries = self.partitions(symbol, timeframe)
+        return max(entry['max_ts'] for _, entry in entries) if entries else None
+
+    def recent(self, symbol, timeframe, limit, before_ms=None):
+        """
+        Return the newest `limit` cached candles as (start_ms, open, high, low, close, volume) tuples, oldest first.
+
+        With `before_ms`, only candles opening before it are considered.
+        """
+        tables = []
+        remaining = limit
+        end_ms = before_ms - 1 if before_ms is not None else None
+        for partition, _ in reversed(self.partitions(symbol, timeframe, end_ms=end_ms)):
+            table = pq.read_table(self._path(partition), columns=CACHE_COLUMNS, memory_map=True)
+            if end_ms is not None:
+                table = table.filter(pc.less_equal(table.column('ts'), end_ms))
+            tables.append(table)
+            remaining -= table.num_rows
+            if remaining <= 0:
+                break
+        if not tables:
+            return []
+        table = pa.concat_tables(reversed(tables))
+        table = table.slice(max(table.num_rows - limit, 0))
+        data = table.to_pydict()
+        return list(zip(*(data[column] for column in CACHE_COLUMNS)))
+
+
+class WriteThroughCacheWriter:
+    """Candle writer that writes to the database first and then to the local cache."""
+
+    def __init__(self, writer, cache):
+        self.writer = writer
+        self.cache = cache
+
+    async def write(self, rows):
+        count = await self.writer.write(rows)
+        streams = {}
+        for row in rows:
+            streams.setdefault((row['symbol'], row['timeframe']), []).append(row)
+        for (symbol, timeframe), stream_rows in streams.items():
+            try:
+                await asyncio.to_thread(self.cache.write, symbol, timeframe, stream_rows)
+            except Exception as e:
+                logger.error(f"Error writing {len(stream_rows)} candles for {symbol} {timeframe} to the local cache: {e}")
+        return count
+
+    async def close(self):
+        await self.writer.close()
+        await asyncio.to_thread(self.cache.flush)
+
+
+def create_candle_cache(config):
+    """Return the local candle cache configured by CANDLE_CACHE_DIR, or None when it is disabled or pyarrow is missing."""
+    if not config.CANDLE_CACHE_DIR:
+        return None
+    if pa is None:
+        logger.warning("pyarrow is not installed, the local candle cache is disabled")
+        return None
+    return CandleCache(config.CANDLE_CACHE_DIR)
@@ -11,3 +11,85 @@ CREATE TABLE IF NOT EXISTS candles (
     UNIQUE (symbol, timeframe, datetime),
     rsi DOUBLE PRECISION
 );
+
+-- Indicator columns written by the live path (also applied to existing tables)
+ALTER TABLE candles
+    ADD COLUMN IF NOT EXISTS macd_line DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS signal_line DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS macd_histogram DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS middle_band DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS upper_band DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS lower_band DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS sma DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_0_0 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_23_6 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_38_2 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_50_0 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_61_8 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS fib_100_0 DOUBLE PRECISION;
+
+-- Length of one candle of a Bybit interval ("1" ... "720", "D", "W", "M")
+CREATE OR REPLACE FUNCTION candle_step(p_timeframe TEXT)
+RETURNS INTERVAL
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN p_timeframe ~ '^[0-9]+$' THEN make_interval(mins => p_timeframe::INT)
+        WHEN p_timeframe = 'D' THEN INTERVAL '1 day'
+        WHEN p_timeframe = 'W' THEN INTERVAL '1 week'
+        WHEN p_timeframe = 'M' THEN INTERVAL '1 month'
+    END
+$$;
+
+-- Coverage summary: one row per contiguous run of stored candles ('covered') and
+-- per hole between two runs ('missing'), for every stream matching the filters.
+-- Holes before the first or after the last stored candle are left to the caller.
+-- Usage: SELECT * FROM candle_coverage('BTCUSDT', '1', '2024-01-01', '2025-01-01');
+CREATE OR REPLACE FUNCTION candle_coverage(
+    p_symbol TEXT DEFAULT NULL,
+    p_timeframe TEXT DEFAULT NULL,
+    p_start TIMESTAMP DEFAULT NULL,
+    p_end TIMESTAMP DEFAULT NULL
+)
+RETURNS TABLE (
+    symbol VARCHAR,
+    timeframe VARCHAR,
+    status TEXT,
+    range_start TIMESTAMP,
+    range_end TIMESTAMP,
+    candles BIGINT
+)
+LANGUAGE sql STABLE AS $$
+    WITH marked AS (
+        SELECT c.symbol, c.timeframe, c.datetime,
+               CASE WHEN c.datetime = LAG(c.datetime) OVER w + candle_step(c.timeframe) THEN 0 ELSE 1 END AS run_start
+        FROM candles c
+        WHERE (p_symbol IS NULL OR c.symbol = p_symbol)
+          AND (p_timeframe IS NULL OR c.timeframe = p_timeframe)
+          AND (p_start IS NULL OR c.datetime >= p_start)
+          AND (p_end IS NULL OR c.datetime < p_end)
+        WINDOW w AS (PARTITION BY c.symbol, c.timeframe ORDER BY c.datetime)
+    ),
+    numbered AS (
+        SELECT m.*, SUM(m.run_start) OVER (PARTITION BY m.symbol, m.timeframe ORDER BY m.datetime) AS run
+        FROM marked m
+    ),
+    covered AS (
+        SELECT n.symbol, n.timeframe, MIN(n.datetime) AS range_start, MAX(n.datetime) AS range_end, COUNT(*) AS candles,
+               LEAD(MIN(n.datetime)) OVER (PARTITION BY n.symbol, n.timeframe ORDER BY MIN(n.datetime)) AS next_start
+        FROM numbered n
+        GROUP BY n.symbol, n.timeframe, n.run
+    )
+    SELECT cv.symbol, cv.timeframe, 'covered', cv.range_start, cv.range_end, cv.candles
+    FROM covered cv
+    UNION ALL
+    SELECT cv.symbol, cv.timeframe, 'missing',
+           cv.range_end + candle_step(cv.timeframe),
+           cv.next_start - candle_step(cv.timeframe),
+           CASE
+               WHEN cv.timeframe = 'M' THEN (EXTRACT(YEAR FROM age(cv.next_start, cv.range_end)) * 12 + EXTRACT(MONTH FROM age(cv.next_start, cv.range_end)))::BIGINT - 1
+               ELSE (EXTRACT(EPOCH FROM cv.next_start - cv.range_end) / EXTRACT(EPOCH FROM candle_step(cv.timeframe)))::BIGINT - 1
+           END
+    FROM covered cv
+    WHERE cv.next_start IS NOT NULL AND candle_step(cv.timeframe) IS NOT NULL
+    ORDER BY 1, 2, 4
+$$;
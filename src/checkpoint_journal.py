@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+from loguru import logger
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS finished_windows (
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL
+)
+"""
+JOURNAL_INDEX = "CREATE INDEX IF NOT EXISTS finished_windows_stream ON finished_windows (symbol, timeframe, start_ms)"
+
+
+def merge_ranges(ranges):
+    """Merge (start_ms, end_ms) ranges, end inclusive, that overlap or touch into sorted disjoint runs."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class CheckpointJournal:
+    """
+    Local SQLite record of the backfill windows whose candles have been committed.
+
+    Every window is journaled once its rows are written, so a restarted
+    backfill skips straight to the windows that are still missing without
+    asking the database where each stream stopped. Ranges use the scheduler's
+    window bounds: epoch ms, end inclusive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(JOURNAL_SCHEMA)
+        self.connection.execute(JOURNAL_INDEX)
+        self.connection.commit()
+
+    def record(self, symbol, timeframe, ranges):
+        """Journal finished (start_ms, end_ms) windows of a stream."""
+        if not ranges:
+            return
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO finished_windows (symbol, timeframe, start_ms, end_ms) VALUES (?, ?, ?, ?)",
+                [(symbol, timeframe, start, end) for start, end in ranges],
+            )
+
+    def finished(self, symbol, timeframe):
+        """
+        Return the finished ranges of a stream as sorted, disjoint (start_ms, end_ms) runs.
+
+        The stored windows are compacted into these runs on the way, so the
+        journal stays a few rows per stream however many pages were written.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT start_ms, end_ms FROM finished_windows WHERE symbol = ? AND timeframe = ?", (symbol, timeframe)
+            ).fetchall()
+            merged = merge_ranges(rows)
+            if len(merged) < len(rows):
+                with self.connection:
+                    self.connection.execute("DELETE FROM finished_windows WHERE symbol = ? AND timeframe = ?", (symbol, timeframe))
+                    self.connection.executemany(
+                        "INSERT INTO finished_windows (symbol, timeframe, start_ms, end_ms) VALUES (?, ?, ?, ?)",
+                        [(symbol, timeframe, start, end) for start, end in merged],
+                    )
+        return merged
+
+    def has_stream(self, symbol, timeframe):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM finished_windows WHERE symbol = ? AND timeframe = ? LIMIT 1", (symbol, timeframe)
+            ).fetchone()
+        return row is not None
+
+    def remaining(self, symbol, timeframe, start_ms, end_ms):
+        """Return the parts of [start_ms, end_ms) not covered by finished windows, as half-open (start_ms, end_ms) ranges."""
+        remaining = []
+        current = start_ms
+        for run_start, run_end in self.finished(symbol, timeframe):
+            if run_end < current:
+                continue
+            if run_start >= end_ms:
+                break
+            if run_start > current:
+                remaining.append((current, run_start))
+            current = max(current, run_end + 1)
+        if current < end_ms:
+            remaining.append((current, end_ms))
+        return remaining
+
+    def resume_time(self, symbol, timeframe, start_ms):
+        """Return the first epoch ms at or after `start_ms` that no finished window covers."""
+        for run_start, run_end in self.finished(symbol, timeframe):
+            if run_start <= start_ms <= run_end:
+                return run_end + 1
+        return start_ms
+
+    def close(self):
+        self.connection.close()
+
+
+def create_checkpoint_journal(config):
+    """Return the checkpoint journal configured by BACKFILL_JOURNAL, or None when it is disabled."""
+    if not config.BACKFILL_JOURNAL:
+        return None
+    logger.debug(f"Using the backfill checkpoint journal at {config.BACKFILL_JOURNAL}")
+    return CheckpointJournal(config.BACKFILL_JOURNAL)
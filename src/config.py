@@ -1,4 +1,5 @@
 import os
+from typing import List, Optional
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
@@ -10,6 +11,50 @@ class Config(BaseSettings):
     BYBIT_API_SECRET: str = Field(..., env="BYBIT_API_SECRET")
     BYBIT_WS_URL: str = "wss://stream.bybit.com/v5/public/linear"
     BYBIT_REST_URL: str = "https://api.bybit.com"
+    # Kline topics per WebSocket, topics per subscribe request and seconds between application-level pings
+    WS_TOPICS_PER_CONNECTION: int = 200
+    WS_ARGS_PER_SUBSCRIBE: int = 10
+    WS_PING_INTERVAL: float = 20.0
+    WS_QUEUE_SIZE: int = 10000
+    # Reconnect backoff per socket: first delay and cap in seconds (full jitter)
+    WS_RECONNECT_DELAY: float = 1.0
+    WS_MAX_RECONNECT_DELAY: float = 60.0
+    # Bounded queues between the live pipeline stages and the number of persist workers
+    PIPELINE_QUEUE_SIZE: int = 1000
+    PIPELINE_PERSIST_WORKERS: int = 2
+    # Seconds between dashboard refreshes; in-progress candles are passed on at this rate
+    DASHBOARD_REFRESH_INTERVAL: float = 1.0
+    # Optional list of symbols to show on the dashboard and rows per page (pages rotate when set)
+    DASHBOARD_SYMBOLS: Optional[List[str]] = None
+    DASHBOARD_PAGE_SIZE: Optional[int] = None
+    # Seconds between live stream health checks, and how late a confirmation may be before a stream is stale
+    HEALTH_CHECK_INTERVAL: float = 30.0
+    HEALTH_GRACE_PERIOD: float = 120.0
+    # Fetch and subscribe to 1-minute candles only and build the other timeframes from them
+    RESAMPLE_FROM_1M: bool = False
+    # Prometheus metrics endpoint served in --headless mode
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9108
+    # Bybit allows 600 REST requests per IP in any 5 second window
+    BYBIT_REST_RATE_LIMIT: int = 600
+    BYBIT_REST_RATE_WINDOW: float = 5.0
+    BACKFILL_CONCURRENCY: int = 16
+    BACKFILL_WRITE_CONCURRENCY: int = 4
+    # SQLite journal of committed backfill windows, used to resume without probing the database; set to an empty value to disable it
+    BACKFILL_JOURNAL: Optional[str] = "backfill_journal.db"
+    # In-memory cache of REST kline pages (0 disables it) and seconds the page holding the open candle is reused
+    KLINE_CACHE_MAX_MB: int = 64
+    KLINE_CACHE_OPEN_TTL: float = 5.0
+    # Direct Postgres connection string; when set, candles are written with asyncpg COPY instead of PostgREST
+    DATABASE_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 4
+    WRITE_BATCH_SIZE: int = 10000
+    LIVE_FLUSH_INTERVAL: float = 1.0
+    # Local Parquet candle cache; set to an empty value to disable it
+    CANDLE_CACHE_DIR: Optional[str] = "candle_cache"
+    # Memory-mapped ring buffers of recent live candles; set to an empty value to disable them
+    RING_BUFFER_DIR: Optional[str] = "ring_buffers"
+    RING_BUFFER_CAPACITY: int = 1000
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,90 +1,105 @@
+import time
 from rich.table import Table
 from rich.panel import Panel
-from datetime import datetime
-from dateutil.parser import parse as parse_date
-import numpy as np  # Import numpy for NaN handling
 
-def create_dashboard(symbols_data):
-    table = Table(title="Cryptocurrency Data")
-    table.add_column("Symbol", style="cyan")
-    table.add_column("Timeframe", style="cyan")
-    table.add_column("Data Health", style="green")
-    table.add_column("Timestamp", style="cyan")
-    table.add_column("Open", style="magenta")
-    table.add_column("High", style="green")
-    table.add_column("Low", style="red")
-    table.add_column("Close", style="yellow")
-    table.add_column("Volume", style="blue")
-    # table.add_column("RSI", style="cyan")
-    # table.add_column("MACD Line", style="cyan")
-    # table.add_column("Signal Line", style="cyan")
-    # table.add_column("MACD Histogram", style="cyan")
-    # table.add_column("Middle Band", style="cyan")
-    # table.add_column("Upper Band", style="cyan")
-    # table.add_column("Lower Band", style="cyan")
-    # table.add_column("SMA", style="cyan")
-    # table.add_column("Fib 0.0%", style="cyan")
-    # table.add_column("Fib 23.6%", style="cyan")
-    # table.add_column("Fib 38.2%", style="cyan")
-    # table.add_column("Fib 50.0%", style="cyan")
-    # table.add_column("Fib 61.8%", style="cyan")
-    # table.add_column("Fib 100.0%", style="cyan")
+from tracing import traced
 
-    for symbol, timeframes in symbols_data.items():
-        for timeframe, data in timeframes.items():
-            kline = data['kline']
-            is_healthy = data['is_healthy']
-            health_status = "🟢" if is_healthy else "🔴"
+COLUMNS = [
+    ("Symbol", "cyan"),
+    ("Timeframe", "cyan"),
+    ("Data Health", "green"),
+    ("Timestamp", "cyan"),
+    ("Open", "magenta"),
+    ("High", "green"),
+    ("Low", "red"),
+    ("Close", "yellow"),
+    ("Volume", "blue"),
+]
+PRICE_FIELDS = ['open', 'high', 'low', 'close', 'volume']
 
-            if kline:
-                # Handle both Unix timestamp and ISO format
-                if isinstance(kline['start'], (int, float)):
-                    timestamp = datetime.fromtimestamp(int(kline['start']) // 1000)
-                else:
-                    timestamp = parse_date(kline['start'])
 
-                # Access the RSI value from the data dictionary
-                rsi = kline.get('rsi', np.nan)  # Corrected to access from kline
+class DashboardModel:
+    """
+    Row state of the live dashboard, rendered by Rich on its own timer.
 
-                # Access the MACD values from the data dictionary
-                macd = kline.get('macd', {})  # Corrected to access from kline
-                macd_line = macd.get('macd_line', np.nan)
-                signal_line = macd.get('signal_line', np.nan)
-                macd_histogram = macd.get('histogram', np.nan)
+    `update` only rewrites the cells whose values changed and marks the model
+    dirty; `__rich__` (called by `rich.live.Live` on every refresh) rebuilds the
+    table only when something changed since the last refresh, so rendering
+    cost depends on the refresh rate and page size, not on the message rate.
+    """
 
-                # Access the Bollinger Bands values from the data dictionary
-                bollinger_bands = kline.get('bollinger_bands', {})
-                middle_band = bollinger_bands.get('middle_band', np.nan)
-                upper_band = bollinger_bands.get('upper_band', np.nan)
-                lower_band = bollinger_bands.get('lower_band', np.nan)
+    def __init__(self, symbols, timeframes, health=None, symbol_filter=None, page_size=None, page_interval=5.0):
+        """
+        :param health: Optional callable (symbol, timeframe) -> bool for the health column.
+        :param symbol_filter: Optional list of symbols to show; updates for the others are ignored.
+        :param page_size: Rows per page; pages rotate every `page_interval` seconds when set.
+        """
+        self.health = health
+        self.page_size = page_size
+        self.page_interval = page_interval
+        self.rows = {}
+        for symbol in symbols:
+            if symbol_filter and symbol not in symbol_filter:
+                continue
+            for timeframe in timeframes:
+                self.rows[(symbol, timeframe)] = [symbol, timeframe, "🔴", "", "", "", "", "", ""]
+        self.dirty = True
+        self._table = None
+        self._page = None
 
-                # Access the SMA value from the data dictionary
-                sma = kline.get('sma', np.nan)
+    def update(self, symbol, timeframe, candle):
+        """Copy the displayed fields of a `candle.Candle` into its row."""
+        row = self.rows.get((symbol, timeframe))
+        if row is None:
+            return
+        cells = [candle.datetime.isoformat(sep=' ')] + [str(getattr(candle, field)) for field in PRICE_FIELDS]
+        if row[3:] != cells:
+            row[3:] = cells
+            self.dirty = True
 
-                # Access the Fibonacci levels from the data dictionary
-                fibonacci = kline.get('fibonacci', {})
-                fib_0_0 = fibonacci.get('0.0%', np.nan)
-                fib_23_6 = fibonacci.get('23.6%', np.nan)
-                fib_38_2 = fibonacci.get('38.2%', np.nan)
-                fib_50_0 = fibonacci.get('50.0%', np.nan)
-                fib_61_8 = fibonacci.get('61.8%', np.nan)
-                fib_100_0 = fibonacci.get('100.0%', np.nan)
+    def _refresh_health(self, keys):
+        if self.health is None:
+            return
+        for key in keys:
+            status = "🟢" if self.health(*key) else "🔴"
+            row = self.rows[key]
+            if row[2] != status:
+                row[2] = status
+                self.dirty = True
 
-                table.add_row(
-                    str(symbol),
-                    str(timeframe),
-                    health_status,
-                    str(timestamp),
-                    str(kline['open']),
-                    str(kline['high']),
-                    str(kline['low']),
-                    str(kline['close']),
-                    str(kline['volume']),
-                )
-            else:
-                table.add_row(str(symbol), str(timeframe), health_status, "", "", "", "", "", "")
+    def _visible(self):
+        keys = list(self.rows)
+        if not self.page_size or len(keys) <= self.page_size:
+            return keys, None
+        pages = (len(keys) + self.page_size - 1) // self.page_size
+        page = int(time.monotonic() // self.page_interval) % pages
+        return keys[page * self.page_size:(page + 1) * self.page_size], (page, pages)
 
-        # Add a blank row after each symbol for separation
-        table.add_row("", "", "", "", "", "", "", "", "")
+    @traced('dashboard.render')
+    def render(self):
+        keys, page = self._visible()
+        self._refresh_health(keys)
+        if self._table is not None and not self.dirty and page == self._page:
+            return self._table
+
+        # Clear the flag first so an update made while the table is built shows up on the next refresh
+        self.dirty = False
+        title = "Cryptocurrency Data" if page is None else f"Cryptocurrency Data (page {page[0] + 1}/{page[1]})"
+        table = Table(title=title)
+        for name, style in COLUMNS:
+            table.add_column(name, style=style)
+        previous_symbol = None
+        for key in keys:
+            if previous_symbol is not None and key[0] != previous_symbol:
+                # Add a blank row after each symbol for separation
+                table.add_row(*[""] * len(COLUMNS))
+            table.add_row(*self.rows[key])
+            previous_symbol = key[0]
+
+        self._table = Panel(table)
+        self._page = page
+        return self._table
+
+    def __rich__(self):
+        return self.render()
 
-    return Panel(table)
\ No newline at end of file
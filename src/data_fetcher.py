@@ -1,13 +1,14 @@
-import asyncio
-import pandas as pd
 import datetime
 from loguru import logger
-import aiohttp
-from supabase import create_client, Client
-from rich.progress import Progress
-import indicators
+import numpy as np
+from supabase import Client
+from metrics import REST_REQUESTS
+from storage import SupabaseCandleWriter, kline_rows
+from timeframes import MAX_KLINES_PER_REQUEST, normalize_timeframe, to_ms
+from tracing import traced
 
-from config import Config
+from decoding import decode_kline_rows, loads
+from kline_cache import shared_page_cache
 
 async def create_schema(supabase: Client):
     supabase.table('candles').insert({
@@ -21,181 +22,153 @@ async def create_schema(supabase: Client):
         'volume': 0,
     }, upsert=True)
 
-async def fetch_klines(session, symbol, timeframe, start_time, end_time, config):
+@traced('fetch_kline_page')
+async def fetch_kline_page(session, symbol, timeframe, start_ms, end_ms, config, limit=MAX_KLINES_PER_REQUEST, rate_limiter=None):
     """
-    Fetches kline data from Bybit API and calculates RSI. Handles cases with insufficient data.
+    Fetches one page of raw klines from the Bybit API.
 
     Args:
         session (aiohttp.ClientSession): An aiohttp client session.
         symbol (str): The trading symbol (e.g., BTCUSDT).
-        interval (str): The candlestick timeframe (e.g., "1", "5m", etc.).
-        start_time (datetime.datetime): The start time for fetching data.
-        end_time (datetime.datetime): The end time for fetching data.
+        timeframe (str): The Bybit interval (e.g., "1", "240", "D").
+        start_ms (int): Start of the request window in epoch ms (inclusive).
+        end_ms (int): End of the request window in epoch ms (inclusive).
         config (Config): Configuration object containing API details.
+        limit (int): Maximum number of candles to return (Bybit caps this at 1000).
+        rate_limiter (TokenBucket, optional): Shared limiter to wait on before the request.
 
     Returns:
-        list: A list of klines with RSI values appended (or None if insufficient data).
+        numpy.ndarray: The page as a `decoding.KLINE_DTYPE` array ordered oldest first, or None if the request failed.
     """
-
     params = {
         "category": "linear",
         "symbol": symbol,
         "interval": timeframe,
-        "start": int(start_time.timestamp() * 1000),
-        "end": int(end_time.timestamp() * 1000),
-        "limit": 1000,  # Adjust limit based on your needs
+        "start": start_ms,
+        "end": end_ms,
+        "limit": limit,
     }
     url = f"{config.BYBIT_REST_URL}/v5/market/kline"
-    logger.debug(f"Fetching klines from API: {url}")
-    logger.debug(f"Request parameters: {params}")
+    logger.debug("Fetching klines from API: {} {}", url, params)
+
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
 
     async with session.get(url, params=params) as response:
-        logger.debug(f"API response status: {response.status}")
-        if response.status == 200:
-            data = await response.json()
-            logger.debug(f"API response data: {data}")
-            result = data.get('result', {}).get('list', [])
-
-            # Check if data is empty or insufficient for RSI calculation
-            if not result or len(result) < 14:  # Assuming RSI window is 14
-                logger.warning(f"Insufficient data for RSI calculation. Fetched {len(result)} klines (needed at least 14)")
-                return None
-
-            # Log closing prices before calculation
-            closing_prices = [float(k[4]) for k in result]  # Assuming close price is at index 4
-            logger.debug(f"Extracted closing prices: {closing_prices}")
-
-            # Calculate RSI and log the value
-            rsi = indicators.calculate_rsi(closing_prices)
-            logger.debug(f"Calculated RSI: {rsi}")
-
-            # Append RSI to each kline
-            for kline in result:
-                kline.append(rsi)  # Assuming kline is a mutable list
-
-            return result
-        else:
+        logger.debug("API response status: {}", response.status)
+        if response.status in (403, 429):
+            logger.warning(f"Rate limited by Bybit (status {response.status}), backing off")
+            REST_REQUESTS.inc(outcome='rate_limited')
+            if rate_limiter is not None:
+                rate_limiter.penalize(5)
+            return None
+        if response.status != 200:
             error_message = await response.text()
             logger.error(f"Failed to fetch klines. Status code: {response.status}, Error message: {error_message}")
-            return []
+            REST_REQUESTS.inc(outcome='error')
+            return None
+
+        # Parse the body once and convert the rows to numbers in a single pass
+        data = loads(await response.read())
+        logger.debug("API response data: {}", data)
+        if data.get('retCode') == 10006:
+            logger.warning(f"Rate limited by Bybit: {data.get('retMsg')}")
+            REST_REQUESTS.inc(outcome='rate_limited')
+            if rate_limiter is not None:
+                rate_limiter.penalize(5)
+            return None
+        if data.get('retCode', 0) != 0:
+            logger.error(f"Bybit returned an error for {symbol} {timeframe}: {data.get('retMsg')}")
+            REST_REQUESTS.inc(outcome='error')
+            return None
+        REST_REQUESTS.inc(outcome='ok')
+        return decode_kline_rows(data.get('result', {}).get('list', []))
+
+async def fetch_kline_range(session, symbol, timeframe, start_ms, end_ms, config, limit=MAX_KLINES_PER_REQUEST, rate_limiter=None):
+    """
+    Fetches every kline in [start_ms, end_ms], following the end timestamp of each page.
 
-async def upsert_klines(supabase: Client, klines, symbol, timeframe):
-    data = [
-        {
-            'symbol': symbol,
-            'timeframe': timeframe,
-            'datetime': datetime.datetime.fromtimestamp(int(k[0])/1000).isoformat(),
-            'open': float(k[1]),
-            'high': float(k[2]),
-            'low': float(k[3]),
-            'close': float(k[4]),
-            'volume': float(k[5]),
-            'rsi': float(k[6]), # Add RSI to the data
-        }
-        for k in klines
-    ]
-    # Rest of the function remains the same
-    temp_df = pd.DataFrame(data)
-    temp_df.drop_duplicates(subset=['symbol', 'timeframe', 'datetime'], inplace=True)
-    unique_data = temp_df.to_dict('records')
+    Bybit's kline endpoint has no cursor: a full page holds the newest `limit`
+    candles of the window, so the next request ends just before the oldest
+    candle of the previous reply. Windows from `timeframes.plan_kline_windows`
+    fit in a single page; larger ranges are walked page by page.
+
+    Returns:
+        numpy.ndarray: A `decoding.KLINE_DTYPE` array ordered oldest first, or None if any request failed.
+    """
+    pages = []
+    current_end = end_ms
+    while current_end >= start_ms:
+        page = await fetch_kline_page(session, symbol, timeframe, start_ms, current_end, config, limit, rate_limiter)
+        if page is None:
+            return None
+        pages.append(page)
+        if len(page) < limit:
+            break
+        oldest = int(page['start'][0])
+        if oldest <= start_ms:
+            break
+        current_end = oldest - 1
+    # Pages were fetched newest first and never overlap
+    return np.concatenate(pages[::-1]) if pages else decode_kline_rows([])
+
+@traced('fetch_klines')
+async def fetch_klines(session, symbol, timeframe, start_time, end_time, config, rate_limiter=None, use_cache=True):
+    """
+    Fetches kline data from Bybit API.
+
+    Indicators are no longer attached here: they need the history before the
+    page, so the backfill computes them over the whole series (see
+    `indicators.calculate_indicator_series`).
+
+    Args:
+        session (aiohttp.ClientSession): An aiohttp client session.
+        symbol (str): The trading symbol (e.g., BTCUSDT).
+        interval (str): The candlestick timeframe (e.g., "1", "5m", etc.).
+        start_time (datetime.datetime | int): The start time for fetching data (datetime or epoch ms).
+        end_time (datetime.datetime | int): The end time for fetching data (datetime or epoch ms).
+        config (Config): Configuration object containing API details.
+        rate_limiter (TokenBucket, optional): Shared limiter to wait on before each request.
+        use_cache (bool): Serve the range from the shared `kline_cache.KlinePageCache` when it is enabled.
+            One-off history (e.g. a backfill) should skip it: pages are fetched whole and aligned, and
+            they would evict pages that are reused.
+
+    Returns:
+        numpy.ndarray: A `decoding.KLINE_DTYPE` array ordered oldest first, or None if a request failed.
+    """
+    timeframe = normalize_timeframe(timeframe)
+    cache = shared_page_cache(config) if use_cache else None
+    if cache is None:
+        return await fetch_kline_range(session, symbol, timeframe, to_ms(start_time), to_ms(end_time), config, rate_limiter=rate_limiter)
+
+    async def load(page_start, page_end):
+        return await fetch_kline_range(session, symbol, timeframe, page_start, page_end, config, rate_limiter=rate_limiter)
+
+    return await cache.fetch(symbol, timeframe, to_ms(start_time), to_ms(end_time), load)
 
+@traced('upsert_klines')
+async def upsert_klines(supabase: Client, klines, symbol, timeframe):
     try:
-        response = supabase.table('candles').insert(unique_data).execute()
-        result = response.data
-        logger.debug(f"Upserted {len(result)} klines to the database.")
+        count = await SupabaseCandleWriter(supabase).write(kline_rows(klines, symbol, timeframe))
+        logger.debug("Upserted {} klines to the database.", count)
     except Exception as e:
         logger.error(f"Error upserting klines to the database: {e}")
 
-async def upsert_klines_websocket(pool, klines, symbol, timeframe):
+@traced('upsert_klines_websocket')
+async def upsert_klines_websocket(writer, candles, symbol, timeframe):
+    """Queue live candles (`candle.Candle`, with their indicators) on the batching writer; they land on its next flush."""
     try:
-        for kline in klines:
-            # Debug: Print kline data being upserted
-            print(f"Upserting kline data for {symbol} ({timeframe}): {kline}")
-
-            # Prepare the data for upsert
-            data = {
-                'symbol': symbol,
-                'timeframe': timeframe,
-                'start': kline['start'],
-                'open': kline['open'],
-                'high': kline['high'],
-                'low': kline['low'],
-                'close': kline['close'],
-                'volume': kline['volume'],
-                'rsi': kline['rsi'],
-                'macd_line': kline['macd']['macd_line'],
-                'signal_line': kline['macd']['signal_line'],
-                'macd_histogram': kline['macd']['histogram'],
-                'middle_band': kline['bollinger_bands']['middle_band'],
-                'upper_band': kline['bollinger_bands']['upper_band'],
-                'lower_band': kline['bollinger_bands']['lower_band'],
-                'sma': kline['sma'],
-                'fib_0_0': kline['fibonacci']['0.0%'],
-                'fib_23_6': kline['fibonacci']['23.6%'],
-                'fib_38_2': kline['fibonacci']['38.2%'],
-                'fib_50_0': kline['fibonacci']['50.0%'],
-                'fib_61_8': kline['fibonacci']['61.8%'],
-                'fib_100_0': kline['fibonacci']['100.0%']
-            }
-
-            # Perform the upsert operation
-            response = await pool.table('klines').upsert(data).execute()
-            if response.status_code == 200:
-                logger.debug(f"Successfully upserted kline data for {symbol} ({timeframe})")
-            else:
-                logger.error(f"Failed to upsert kline data for {symbol} ({timeframe}): {response}")
-
-        logger.debug(f"Upserted {len(klines)} klines into Supabase")
+        rows = [candle.row(symbol, timeframe) for candle in candles]
+        # Bybit's kline timestamps let the writer report latency up to the commit
+        await writer.add(rows, [candle.timestamp for candle in candles if candle.timestamp])
+        logger.debug("Queued {} klines for {} ({}) for the next database flush", len(rows), symbol, timeframe)
     except Exception as e:
-        logger.error(f"Error upserting klines into Supabase: {e}")
+        logger.error(f"Error queueing klines for the database: {e}")
 
-# async def fetch_initial_data(symbol, timeframes, start_date, config, batch_size=1440, calculate_rsi_func=indicators.calculate_rsi):
-async def fetch_initial_data(symbol, timeframes, start_date, config, batch_size=1440):
-    logger.debug(f"Fetching initial data for {symbol} (timeframes: {timeframes}) from {start_date} with batch size {batch_size}")
+async def fetch_initial_data(symbol, timeframes, start_date, config, batch_size=MAX_KLINES_PER_REQUEST):
+    from backfill_scheduler import run_backfill
 
-    supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
-
-    await create_schema(supabase)
-
-    start_time = datetime.datetime.fromisoformat(start_date)
-    end_time = datetime.datetime.now()
-
-    for timeframe in timeframes:
-        logger.debug(f"Checking for existing data in the database for timeframe {timeframe}...")
-        existing_data_response = supabase.table('candles').select('datetime').eq('symbol', symbol).eq('timeframe', timeframe).order('datetime', desc=True).limit(1).execute()
-        existing_data = existing_data_response.data
-        if existing_data:
-            latest_datetime = datetime.datetime.fromisoformat(existing_data[0]['datetime'])
-            if latest_datetime >= end_time:
-                logger.debug(f"Data for {symbol} (timeframe: {timeframe}) is already up to date")
-                continue
-            current_start_time = latest_datetime + datetime.timedelta(minutes=1)  # Start from the next minute after the latest data
-            logger.debug(f"Found existing data for timeframe {timeframe}. Resuming from {current_start_time}")
-        else:
-            current_start_time = start_time
-            logger.debug(f"No existing data found for timeframe {timeframe}. Fetching from {current_start_time}")
-        
-        logger.debug("Fetching latest RSI for", timeframe)
-        latest_data_response = supabase.table('candles').select('rsi').eq('symbol', symbol).eq('timeframe', timeframe).order('datetime', desc=True).limit(1).execute()
-        latest_data = latest_data_response.data
-        latest_rsi = None
-        if latest_data:
-            latest_rsi = latest_data[0]['rsi']
-
-        async with aiohttp.ClientSession() as session:
-            with Progress() as progress:
-                task = progress.add_task(f"[green]Fetching data for {timeframe}...", total=(end_time - current_start_time).total_seconds() / 60)
-
-                while current_start_time < end_time:
-                    end_chunk_time = min(current_start_time + datetime.timedelta(minutes=batch_size), end_time)
-                    klines = await fetch_klines(session, symbol, timeframe, current_start_time, end_chunk_time, config)
-                    if klines:
-                        logger.debug(f"Fetched {len(klines)} klines for timeframe {timeframe}. Upserting to database...")
-                        await upsert_klines(supabase, klines, symbol, timeframe)
-                        progress.update(task, advance=(end_chunk_time - current_start_time).total_seconds() / 60)
-                    else:
-                        logger.warning(f"No klines fetched for the period from {current_start_time} to {end_chunk_time} for timeframe {timeframe}")
-                    current_start_time = end_chunk_time  # Move the start time to the end of the current chunk
-                    await asyncio.sleep(0.5)  # Rate limiting
-
-    logger.debug("Initial data fetching completed for all timeframes")
\ No newline at end of file
+    if isinstance(timeframes, str):
+        timeframes = [timeframes]
+    logger.debug(f"Fetching initial data for {symbol} (timeframes: {timeframes}) from {start_date} with batch size {batch_size}")
+    await run_backfill([symbol], timeframes, start_date, config, batch_size)
@@ -1,41 +1,107 @@
+import asyncio
 import datetime
 from loguru import logger
 
-async def check_data_health(pool, symbol, timeframe, config):
-    try:
-        # Get the latest candle from the database
-        result = await pool.table('candles').select('*').eq('symbol', symbol).eq('timeframe', timeframe).order('datetime', desc=True).limit(1).execute()
-        
-        if not result.data:
-            logger.warning(f"No data found for {symbol} ({timeframe})")
-            return False
-        
-        latest_candle = result.data[0]
-        latest_datetime = datetime.datetime.fromisoformat(latest_candle['datetime'])
-        current_time = datetime.datetime.now(datetime.timezone.utc)
-        
-        # Calculate the expected time difference based on the timeframe
-        if timeframe.endswith('m'):
-            expected_diff = datetime.timedelta(minutes=int(timeframe[:-1]))
-        elif timeframe.endswith('h'):
-            expected_diff = datetime.timedelta(hours=int(timeframe[:-1]))
-        elif timeframe == '1d':
-            expected_diff = datetime.timedelta(days=1)
-        else:
-            logger.error(f"Unsupported timeframe format: {timeframe}")
-            return False
-        
-        actual_diff = current_time - latest_datetime
-        
-        # Allow for a small buffer (e.g., 2 minutes) to account for processing delays
-        buffer = datetime.timedelta(minutes=2)
-        
-        if actual_diff <= expected_diff + buffer:
-            return True
-        else:
-            logger.warning(f"Data health check failed for {symbol} ({timeframe}). Latest data: {latest_datetime}, Current time: {current_time}")
-            return False
-    
-    except Exception as e:
-        logger.error(f"Error checking data health for {symbol} ({timeframe}): {e}")
-        return False
\ No newline at end of file
+from backfill_scheduler import BackfillScheduler, TokenBucket
+from timeframes import add_candles, align_open, normalize_timeframe, plan_kline_windows, to_ms
+
+
+class HealthMonitor:
+    """
+    Background health checks for the live streams.
+
+    Tracks the open time of the last confirmed candle of every stream in
+    memory, marks a stream stale once a candle that should have closed has not
+    been confirmed, and repairs it with a backfill job covering only the
+    missing candles. Recording a candle is a dict update, so the live path
+    does no database reads.
+    """
+
+    def __init__(self, config, writer, session, interval=None, grace_seconds=None):
+        self.config = config
+        self.writer = writer
+        self.session = session
+        self.interval = interval or config.HEALTH_CHECK_INTERVAL
+        # Confirmations arrive shortly after a candle closes
+        self.grace_ms = int((grace_seconds if grace_seconds is not None else config.HEALTH_GRACE_PERIOD) * 1000)
+        self.rate_limiter = TokenBucket.for_limit(config.BYBIT_REST_RATE_LIMIT, config.BYBIT_REST_RATE_WINDOW)
+        self.last_confirmed = {}
+        self.healthy = {}
+        self.repairs = {}
+        self._task = None
+
+    def track(self, symbol, timeframe, last_start=None):
+        """Start watching a stream, optionally from the open time of its newest known candle."""
+        self.last_confirmed[(symbol, timeframe)] = last_start
+        self.healthy[(symbol, timeframe)] = False
+
+    def record(self, symbol, timeframe, start_ms):
+        key = (symbol, timeframe)
+        if self.last_confirmed.get(key) is None or start_ms > self.last_confirmed[key]:
+            self.last_confirmed[key] = start_ms
+            self.healthy[key] = True
+
+    def is_healthy(self, symbol, timeframe):
+        return self.healthy.get((symbol, timeframe), False)
+
+    def check(self, now_ms=None):
+        """Update every stream's health and start repairs for stale ones; returns the stale streams."""
+        now_ms = now_ms if now_ms is not None else to_ms(datetime.datetime.now())
+        stale = []
+        for (symbol, timeframe), last_start in self.last_confirmed.items():
+            key = (symbol, timeframe)
+            interval = normalize_timeframe(timeframe)
+            # Open time of the newest candle that should have been confirmed by now
+            expected = add_candles(align_open(now_ms - self.grace_ms, interval), interval, -1)
+            if last_start is not None and last_start >= expected:
+                self.healthy[key] = True
+                continue
+            self.healthy[key] = False
+            stale.append(key)
+            if last_start is None:
+                logger.debug(f"No confirmed candles for {symbol} ({timeframe}) yet")
+                continue
+            if key not in self.repairs:
+                logger.warning(f"{symbol} ({timeframe}) is stale: last confirmed candle {datetime.datetime.fromtimestamp(last_start / 1000)}, repairing")
+                self.repairs[key] = asyncio.create_task(self._repair(symbol, timeframe, add_candles(last_start, interval, 1), add_candles(expected, interval, 1)))
+        return stale
+
+    async def _repair(self, symbol, timeframe, start_ms, end_ms):
+        """Backfill the candles opening in [start_ms, end_ms) of one stream."""
+        key = (symbol, timeframe)
+        interval = normalize_timeframe(timeframe)
+        try:
+            scheduler = BackfillScheduler(self.config, self.writer, rate_limiter=self.rate_limiter, use_page_cache=True)
+            if scheduler.add_windows(symbol, interval, plan_kline_windows(interval, start_ms, end_ms)):
+                await scheduler.run(self.session)
+            # Only committed windows count; a stream with a window left out stays stale and is retried
+            committed = scheduler.committed_through(symbol, interval, start_ms)
+            if committed is None or committed < end_ms - 1:
+                if committed is not None:
+                    self.last_confirmed[key] = max(self.last_confirmed[key], align_open(committed, interval))
+                logger.warning(f"Repair of {symbol} ({timeframe}) from {datetime.datetime.fromtimestamp(start_ms / 1000)} did not complete, retrying on the next check")
+                return
+            self.record(symbol, timeframe, add_candles(end_ms, interval, -1))
+            logger.info(f"Repaired {symbol} ({timeframe}) from {datetime.datetime.fromtimestamp(start_ms / 1000)} to {datetime.datetime.fromtimestamp(end_ms / 1000)}")
+        except Exception as e:
+            logger.error(f"Repair of {symbol} ({timeframe}) failed: {e}")
+        finally:
+            del self.repairs[key]
+
+    async def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error checking stream health: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def close(self):
+        tasks = [task for task in [self._task, *self.repairs.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
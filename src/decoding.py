@@ -0,0 +1,47 @@
+import json
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library parser is used without it
+    orjson = None
+
+# One REST kline row: open time (epoch ms), prices, base volume and quote turnover
+KLINE_DTYPE = np.dtype([
+    ('start', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+    ('turnover', 'f8'),
+])
+
+
+def loads(payload):
+    """Parse a JSON payload (str or bytes) with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def decode_kline_rows(rows):
+    """
+    Convert Bybit kline rows into a `KLINE_DTYPE` array ordered oldest first.
+
+    :param rows: Rows of [start, open, high, low, close, volume, turnover] strings, newest first as Bybit returns them.
+    :return: A structured array; every field is converted from text exactly once, in one NumPy call.
+    """
+    candles = np.empty(len(rows), dtype=KLINE_DTYPE)
+    if not len(rows):
+        return candles
+    # Epoch ms fit exactly in a float64, so one float conversion covers every column
+    values = np.array(rows, dtype=np.float64)[::-1]
+    for column, name in enumerate(KLINE_DTYPE.names):
+        candles[name] = values[:, column]
+    return candles
+
+
+def kline_tuples(candles):
+    """Return a `KLINE_DTYPE` array as (start_ms, open, high, low, close, volume) tuples."""
+    return candles[['start', 'open', 'high', 'low', 'close', 'volume']].tolist()
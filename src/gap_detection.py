@@ -0,0 +1,118 @@
+import numpy as np
+
+from timeframes import MAX_KLINES_PER_REQUEST, WEEK_MS, WEEK_OFFSET_MS, align_open, add_candles, timeframe_ms
+
+
+def candle_indices(timestamps, timeframe):
+    """
+    Map candle open times (epoch ms) onto consecutive integers, one per candle.
+
+    Fixed-length timeframes divide by the candle length (weeks are counted from
+    a Monday); "M" counts calendar months since 1970-01.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    step = timeframe_ms(timeframe)
+    if step is None:
+        return timestamps.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+    offset = WEEK_OFFSET_MS if step == WEEK_MS else 0
+    return (timestamps - offset) // step
+
+
+def index_to_open(index, timeframe):
+    """Inverse of `candle_indices` for a single index."""
+    step = timeframe_ms(timeframe)
+    if step is None:
+        return add_candles(0, timeframe, int(index))
+    offset = WEEK_OFFSET_MS if step == WEEK_MS else 0
+    return int(index) * step + offset
+
+
+def _index_bounds(start_ms, end_ms, timeframe):
+    """Return the indices of the first and last candle that open in [start_ms, end_ms)."""
+    first = candle_indices([align_open(start_ms, timeframe)], timeframe)[0]
+    if index_to_open(first, timeframe) < start_ms:
+        first += 1
+    return first, candle_indices([end_ms - 1], timeframe)[0]
+
+
+def find_gaps(timestamps, start_ms, end_ms, timeframe):
+    """
+    Find the missing candles of a stream between two points in time.
+
+    Args:
+        timestamps (array-like): Stored candle open times (epoch ms) in the range.
+        start_ms (int): Start of the range; the first expected candle opens at or after it.
+        end_ms (int): End of the range (exclusive).
+        timeframe (str): Bybit interval of the stream.
+
+    Returns:
+        list: (first_missing_index, last_missing_index) candle index pairs, inclusive and merged.
+    """
+    first, last = _index_bounds(start_ms, end_ms, timeframe)
+    if last < first:
+        return []
+
+    # Duplicates give a step of 0, so sorting is all the clean-up the input needs
+    indices = np.sort(candle_indices(timestamps, timeframe))
+    indices = indices[(indices >= first) & (indices <= last)]
+    # Sentinels one candle outside the range turn the edges into ordinary gaps
+    bounded = np.concatenate(([first - 1], indices, [last + 1]))
+    jumps = np.flatnonzero(np.diff(bounded) > 1)
+    return list(zip((bounded[jumps] + 1).tolist(), (bounded[jumps + 1] - 1).tolist()))
+
+
+
+def gaps_from_coverage(covered, start_ms, end_ms, timeframe):
+    """
+    Same as `find_gaps`, but from covered ranges instead of individual timestamps.
+
+    Args:
+        covered (list): (first_open_ms, last_open_ms) pairs of contiguous stored runs,
+            e.g. the 'covered' rows of `storage.fetch_coverage`.
+    """
+    first, last = _index_bounds(start_ms, end_ms, timeframe)
+    if last < first:
+        return []
+
+    runs = np.asarray(sorted(covered), dtype=np.int64).reshape(-1, 2)
+    run_starts = np.clip(candle_indices(runs[:, 0], timeframe), first, last + 1)
+    run_ends = np.clip(candle_indices(runs[:, 1], timeframe), first - 1, last)
+    keep = run_starts <= run_ends
+    previous_ends = np.concatenate(([first - 1], np.maximum.accumulate(run_ends[keep])))
+    next_starts = np.concatenate((run_starts[keep], [last + 1]))
+    holes = np.flatnonzero(next_starts - previous_ends > 1)
+    return list(zip((previous_ends[holes] + 1).tolist(), (next_starts[holes] - 1).tolist()))
+
+def coalesce_gaps(gaps, timeframe, page_size=MAX_KLINES_PER_REQUEST):
+    """
+    Turn gap index ranges into REST request windows of at most `page_size` candles.
+
+    Neighbouring gaps that fit in one page together share a request (re-fetching
+    the few stored candles between them is cheaper than another round trip), and
+    gaps longer than a page are split into full pages.
+
+    Returns:
+        list: (start_ms, end_ms) request windows, end inclusive as Bybit expects.
+    """
+    windows = []
+    current = None
+    for gap_start, gap_end in gaps:
+        if current is not None and gap_end - current[0] < page_size:
+            current[1] = gap_end
+            continue
+        if current is not None:
+            windows.append(tuple(current))
+        current = [gap_start, gap_end]
+    if current is not None:
+        windows.append(tuple(current))
+
+    pages = []
+    for window_start, window_end in windows:
+        for page_start in range(window_start, window_end + 1, page_size):
+            page_end = min(page_start + page_size - 1, window_end)
+            pages.append((index_to_open(page_start, timeframe), index_to_open(page_end + 1, timeframe) - 1))
+    return pages
+
+
+def count_missing(gaps):
+    return sum(gap_end - gap_start + 1 for gap_start, gap_end in gaps)
@@ -90,4 +90,131 @@ def calculate_fibonacci_retracement(high, low):
         '61.8%': high - 0.618 * diff,
         '100.0%': low
     }
-    return levels
\ No newline at end of file
+    return levels
+
+# Longest lookback among the rolling indicators; this many candles are carried between chunks
+CARRY_WINDOW = 51
+
+INDICATOR_SERIES = [
+    'rsi', 'macd_line', 'signal_line', 'macd_histogram',
+    'middle_band', 'upper_band', 'lower_band', 'sma',
+    'fib_0_0', 'fib_23_6', 'fib_38_2', 'fib_50_0', 'fib_61_8', 'fib_100_0',
+]
+
+
+class IndicatorCarry:
+    """
+    State carried from one chunk of a contiguous candle series to the next.
+
+    Holds the last CARRY_WINDOW highs/lows/closes for the rolling indicators and
+    the recursive EMA/Wilder states, so chunked computation gives the same values
+    as one pass over the whole series.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.highs = np.empty(0)
+        self.lows = np.empty(0)
+        self.closes = np.empty(0)
+        self.ema_fast = None
+        self.ema_slow = None
+        self.signal = None
+        self.avg_gain = None
+        self.avg_loss = None
+
+
+def _ema(values, span=None, alpha=None, seed=None):
+    """pandas `ewm(adjust=False)` EMA, optionally continuing from a previous EMA value."""
+    if seed is None:
+        return pd.Series(values).ewm(span=span, alpha=alpha, adjust=False).mean().to_numpy()
+    seeded = np.concatenate(([seed], values))
+    return pd.Series(seeded).ewm(span=span, alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+def _wilder_rsi(closes, carry, timeperiod):
+    """Vectorized Wilder RSI matching TA-Lib; `closes` is the chunk, prefixed with the carried tail while unseeded."""
+    rsi = np.full(len(closes), np.nan)
+    if carry.avg_gain is None:
+        changes = np.diff(closes)
+        if len(changes) < timeperiod:
+            return rsi, None, None
+        gains, losses = np.clip(changes, 0, None), np.clip(-changes, 0, None)
+        # TA-Lib seeds the averages with the mean of the first `timeperiod` changes
+        seed_gain, seed_loss = gains[:timeperiod].mean(), losses[:timeperiod].mean()
+        avg_gain = np.concatenate(([seed_gain], _ema(gains[timeperiod:], alpha=1 / timeperiod, seed=seed_gain)))
+        avg_loss = np.concatenate(([seed_loss], _ema(losses[timeperiod:], alpha=1 / timeperiod, seed=seed_loss)))
+        offset = timeperiod
+    else:
+        changes = np.diff(np.concatenate((carry.closes[-1:], closes)))
+        gains, losses = np.clip(changes, 0, None), np.clip(-changes, 0, None)
+        avg_gain = _ema(gains, alpha=1 / timeperiod, seed=carry.avg_gain)
+        avg_loss = _ema(losses, alpha=1 / timeperiod, seed=carry.avg_loss)
+        offset = 0
+    total = avg_gain + avg_loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi[offset:] = np.where(total != 0, 100 * avg_gain / total, 0.0)
+    return rsi, avg_gain[-1], avg_loss[-1]
+
+
+def calculate_indicator_series(highs, lows, closes, carry=None, rsi_period=14, macd_fast=12, macd_slow=26, macd_signal=9, bb_window=20, num_std_dev=2, sma_window=20, fib_window=CARRY_WINDOW):
+    """
+    Calculate every stored indicator over a chunk of a contiguous candle series in one vectorized pass.
+
+    :param highs: Array of high prices for the chunk, oldest first.
+    :param lows: Array of low prices for the chunk, oldest first.
+    :param closes: Array of closing prices for the chunk, oldest first.
+    :param carry: IndicatorCarry from the previous chunk of the same series (updated in place), or None.
+    :return: A dict of arrays keyed by INDICATOR_SERIES, one value per candle of the chunk.
+    """
+    carry = carry or IndicatorCarry()
+    highs, lows, closes = (np.asarray(values, dtype=float) for values in (highs, lows, closes))
+    size = len(closes)
+    tail = len(carry.closes)
+
+    # Rolling indicators work on the carried tail plus the chunk and keep the chunk's part
+    all_highs = np.concatenate((carry.highs, highs))
+    all_lows = np.concatenate((carry.lows, lows))
+    all_closes = pd.Series(np.concatenate((carry.closes, closes)))
+    middle_band = all_closes.rolling(window=bb_window).mean().to_numpy()[tail:]
+    std_dev = all_closes.rolling(window=bb_window).std().to_numpy()[tail:]
+    sma = middle_band if sma_window == bb_window else all_closes.rolling(window=sma_window).mean().to_numpy()[tail:]
+    high = pd.Series(all_highs).rolling(window=fib_window, min_periods=1).max().to_numpy()[tail:]
+    low = pd.Series(all_lows).rolling(window=fib_window, min_periods=1).min().to_numpy()[tail:]
+    diff = high - low
+
+    if carry.avg_gain is None:
+        # Not seeded yet, so the whole history is still in the tail
+        rsi, avg_gain, avg_loss = _wilder_rsi(all_closes.to_numpy(), carry, rsi_period)
+        rsi = rsi[tail:]
+    else:
+        rsi, avg_gain, avg_loss = _wilder_rsi(closes, carry, rsi_period)
+
+    ema_fast = _ema(closes, span=macd_fast, seed=carry.ema_fast)
+    ema_slow = _ema(closes, span=macd_slow, seed=carry.ema_slow)
+    macd_line = ema_fast - ema_slow
+    signal_line = _ema(macd_line, span=macd_signal, seed=carry.signal)
+
+    if size:
+        carry.count += size
+        carry.highs = all_highs[-fib_window:]
+        carry.lows = all_lows[-fib_window:]
+        carry.closes = all_closes.to_numpy()[-max(fib_window, bb_window, sma_window, rsi_period + 1):]
+        carry.ema_fast, carry.ema_slow, carry.signal = ema_fast[-1], ema_slow[-1], signal_line[-1]
+        carry.avg_gain, carry.avg_loss = avg_gain, avg_loss
+
+    return {
+        'rsi': rsi,
+        'macd_line': macd_line,
+        'signal_line': signal_line,
+        'macd_histogram': macd_line - signal_line,
+        'middle_band': middle_band,
+        'upper_band': middle_band + std_dev * num_std_dev,
+        'lower_band': middle_band - std_dev * num_std_dev,
+        'sma': sma,
+        'fib_0_0': high,
+        'fib_23_6': high - 0.236 * diff,
+        'fib_38_2': high - 0.382 * diff,
+        'fib_50_0': high - 0.5 * diff,
+        'fib_61_8': high - 0.618 * diff,
+        'fib_100_0': low,
+    }
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict
+import numpy as np
+
+from decoding import decode_kline_rows
+from gap_detection import candle_indices, index_to_open
+from metrics import KLINE_CACHE_BYTES, KLINE_CACHE_REQUESTS
+from timeframes import MAX_KLINES_PER_REQUEST, align_open, normalize_timeframe
+
+# Candles per cached page; one page is one full Bybit request
+PAGE_CANDLES = MAX_KLINES_PER_REQUEST
+
+
+class KlinePageCache:
+    """
+    In-memory cache of Bybit kline pages, shared by every REST caller of the process.
+
+    Requests are split into pages of `PAGE_CANDLES` candles aligned on candle
+    indices (see `gap_detection.candle_indices`), keyed by (symbol, timeframe,
+    page), so overlapping requests reuse the same pages. A page whose candles
+    have all closed can no longer change and is kept until it is evicted. The
+    page holding the open candle is reused for `open_ttl` seconds while that
+    candle is still in progress, and after that only for candles that had
+    closed when it was fetched. Pages are evicted
+    least recently used once they take more than `max_bytes`. Callers that ask
+    for a page that is already being fetched wait for that request instead of
+    sending their own.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, open_ttl=5.0):
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # (symbol, timeframe, page) -> (klines, closed_before_ms, expires_at); closed pages have no expiry
+        self._pages = OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _lookup(self, key, last_open, open_ms):
+        entry = self._pages.get(key)
+        if entry is None:
+            return None
+        klines, closed_before, expires_at = entry
+        if last_open < closed_before or expires_at is None:
+            fresh = True
+        else:
+            # The snapshot of the candle that was open at fetch time is stale once that candle closes
+            fresh = open_ms <= closed_before and time.monotonic() < expires_at
+        if fresh:
+            self._pages.move_to_end(key)
+            return klines
+        return None
+
+    def _store(self, key, klines, closed_before, expires_at):
+        previous = self._pages.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[0].nbytes
+        self._pages[key] = (klines, closed_before, expires_at)
+        self.bytes += klines.nbytes
+        while self.bytes > self.max_bytes and len(self._pages) > 1:
+            _, (evicted, _, _) = self._pages.popitem(last=False)
+            self.bytes -= evicted.nbytes
+        KLINE_CACHE_BYTES.set(self.bytes)
+
+    async def _load(self, key, page_start, page_end, load):
+        try:
+            fetched_ms = int(time.time() * 1000)
+            klines = await load(page_start, page_end)
+            if klines is not None:
+                # Candles opening before the one in progress at fetch time are final
+                closed_before = align_open(fetched_ms, key[1])
+                if page_end < closed_before:
+                    self._store(key, klines, closed_before, None)
+                else:
+                    self._store(key, klines, closed_before, time.monotonic() + self.open_ttl)
+            return klines
+        finally:
+            del self._in_flight[key]
+
+    async def _page(self, symbol, timeframe, page, last_open, open_ms, load):
+        key = (symbol, timeframe, page)
+        klines = self._lookup(key, last_open, open_ms)
+        if klines is not None:
+            self.hits += 1
+            KLINE_CACHE_REQUESTS.inc(outcome='hit')
+            return klines
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            KLINE_CACHE_REQUESTS.inc(outcome='coalesced')
+        else:
+            self.misses += 1
+            KLINE_CACHE_REQUESTS.inc(outcome='miss')
+            page_start = index_to_open(page * PAGE_CANDLES, timeframe)
+            page_end = index_to_open((page + 1) * PAGE_CANDLES, timeframe) - 1
+            task = self._in_flight[key] = asyncio.ensure_future(self._load(key, page_start, page_end, load))
+        # A cancelled caller must not cancel the request other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def fetch(self, symbol, timeframe, start_ms, end_ms, load):
+        """
+        Return the klines opening in [start_ms, end_ms] from cached pages, loading the missing ones.
+
+        :param load: Coroutine function (page_start_ms, page_end_ms) -> `decoding.KLINE_DTYPE` array
+            or None, e.g. `data_fetcher.fetch_kline_range` bound to a session.
+        :return: A `decoding.KLINE_DTYPE` array ordered oldest first, or None if a page could not be loaded.
+        """
+        timeframe = normalize_timeframe(timeframe)
+        open_ms = align_open(int(time.time() * 1000), timeframe)
+        # Candles that have not opened yet cannot be on any page
+        end_ms = min(end_ms, open_ms)
+        if end_ms < start_ms:
+            return decode_kline_rows([])
+        first, last = candle_indices([start_ms, end_ms], timeframe) // PAGE_CANDLES
+        pages = await asyncio.gather(*[
+            self._page(symbol, timeframe, int(page), end_ms, open_ms, load) for page in range(first, last + 1)
+        ])
+        if any(klines is None for klines in pages):
+            return None
+        klines = np.concatenate(pages)
+        return klines[(klines['start'] >= start_ms) & (klines['start'] <= end_ms)]
+
+
+_shared_cache = None
+
+
+def shared_page_cache(config):
+    """Return the process-wide page cache sized by KLINE_CACHE_MAX_MB, or None when it is disabled."""
+    global _shared_cache
+    if not config.KLINE_CACHE_MAX_MB:
+        return None
+    if _shared_cache is None:
+        _shared_cache = KlinePageCache(config.KLINE_CACHE_MAX_MB * 1024 * 1024, config.KLINE_CACHE_OPEN_TTL)
+    return _shared_cache
@@ -0,0 +1,85 @@
+import threading
+import time
+from loguru import logger
+
+
+class RepeatThrottle:
+    """
+    Loguru filter that lets at most `burst` records per call site through every `interval` seconds.
+
+    Only records at `level` or above are throttled. The first record a call site
+    logs after a throttled window says how many were dropped. The decision is
+    stored on the record, so every sink sharing the filter agrees on it and
+    counts each record once.
+    """
+
+    def __init__(self, interval=60.0, burst=5, level="WARNING"):
+        self.interval = interval
+        self.burst = burst
+        self.level_no = logger.level(level).no
+        self.sites = {}  # (module, function, line) -> [window start, records let through, records dropped]
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        extra = record["extra"]
+        allowed = extra.get("_throttle")
+        if allowed is None:
+            allowed = extra["_throttle"] = self._allow(record)
+        return allowed
+
+    def _allow(self, record):
+        if record["level"].no < self.level_no:
+            return True
+        key = (record["name"], record["function"], record["line"])
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                self.sites[key] = [now, 1, 0]
+                if site is not None and site[2]:
+                    record["message"] += f" ({site[2]} similar messages suppressed in the last {now - site[0]:.0f}s)"
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+def setup_logger(log_level, log_file="app.log", throttle_interval=60.0, throttle_burst=5, console=True):
+    """
+    Send logs to `log_file` (skipped when None) and, unless `console` is False, the console.
+
+    Both sinks are fed from loguru's background queue (`enqueue=True`), so the
+    event loop never waits on the disk or the terminal, and repeated warnings
+    and errors are throttled per call site. Call sites on hot paths pass their
+    values as arguments (`logger.debug("... {}", value)`) so nothing is
+    formatted below the configured level.
+    """
+    logger.remove()  # Remove default handler
+    level = log_level.upper()
+    throttle = RepeatThrottle(throttle_interval, throttle_burst)
+    if log_file:
+        logger.add(
+            log_file,
+            rotation="500 MB",
+            level=level,
+            format="{time} {level} {message}",
+            filter=throttle,
+            enqueue=True,
+            backtrace=True,
+            diagnose=True,
+        )
+    if not console:
+        return throttle
+    logger.add(
+        lambda msg: print(msg, end=""),
+        level=level,
+        format="{message}",
+        filter=throttle,
+        enqueue=True,
+        colorize=True,
+        backtrace=True,
+        diagnose=True,
+    )
+    return throttle
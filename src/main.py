@@ -7,30 +7,14 @@ from supabase import create_client
 from datetime import datetime
 from websocket_handler import start_websocket_connections
 from config import load_config
-from data_fetcher import fetch_initial_data
+from backfill_scheduler import run_backfill
+from sharding import run_sharded
 from test_data_gaps import run_gap_test_and_fill
+from tracing import TRACER, ProfileSwitch, log_summaries
+from log_setup import setup_logger
 
 console = Console()
 
-def setup_logger(log_level):
-    logger.remove()  # Remove default handler
-    logger.add(
-        "app.log",
-        rotation="500 MB",
-        level=log_level.upper(),
-        format="{time} {level} {message}",
-        backtrace=True,
-        diagnose=True,
-    )
-    logger.add(
-        lambda msg: print(msg, end=""),
-        level=log_level.upper(),
-        format="{message}",
-        colorize=True,
-        backtrace=True,
-        diagnose=True,
-    )
-
 async def main():
     parser = argparse.ArgumentParser(description='Bybit Historical Data Reader')
     parser.add_argument('--symbol', type=str, help='Comma-separated trading symbols (e.g., BTCUSDT,ETHUSDT)', default='BTCUSDT')
@@ -38,50 +22,67 @@ async def main():
     parser.add_argument('--start-date', type=str, help='Start date (e.g., 2024-07-01)', default='2024-07-01')
     parser.add_argument('--fetch-initial-data', action='store_true', help='Fetch initial data and create schema')
     parser.add_argument('--log-level', type=str, help='Log level (e.g., DEBUG, INFO, WARNING, ERROR)', default='INFO')
-    parser.add_argument("--batch-size", type=int, default=1440, help="Batch size in minutes (default: 1440)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Candles per REST request (default and maximum: 1000)")
     parser.add_argument("--test-gaps", action='store_true', help="Test for data gaps in Supabase")
     parser.add_argument("--end-date", type=str, help="End date for gap testing (default: current date)", default=None)
+    parser.add_argument("--no-dashboard", action='store_true', help="Run the live mode without the Rich dashboard")
+    parser.add_argument("--trace", type=str, help="Write a Chrome trace (chrome://tracing, Perfetto, speedscope) of the run to this file", default=None)
+    parser.add_argument("--trace-summary", type=float, help="Log a timing summary of the traced sections every N seconds", default=0)
+    parser.add_argument("--resample", action='store_true', help="Fetch and stream 1-minute candles only and build the other timeframes from them")
+    parser.add_argument("--workers", type=int, default=1, help="Split the symbols of the live mode across this many processes")
+    parser.add_argument("--headless", action='store_true', help="Run the live mode without the dashboard and serve Prometheus metrics instead")
     args = parser.parse_args()
 
     setup_logger(args.log_level)
     
     config = load_config()
+    if args.resample:
+        config.RESAMPLE_FROM_1M = True
     supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
 
+    if args.trace:
+        TRACER.start_trace()
+    summary_task = asyncio.create_task(log_summaries(args.trace_summary)) if args.trace_summary else None
+
     # Split the symbols and timeframes strings into lists
     symbols = [symbol.strip() for symbol in args.symbol.split(',')]
     timeframes = [tf.strip() for tf in args.timeframes.split(',')]
 
-    if args.test_gaps:
-        end_date = args.end_date or datetime.now().isoformat()
-        for symbol in symbols:
-            await run_gap_test_and_fill(symbol, args.start_date, end_date, config, timeframes, args.log_level)
-    elif args.fetch_initial_data:
-        for symbol in symbols:
-            for timeframe in timeframes:
-                existing_data_response = supabase.table('candles').select('datetime').eq('symbol', symbol).eq('timeframe', timeframe).order('datetime', desc=True).limit(1).execute()
-                existing_data = existing_data_response.data
-                if existing_data:
-                    latest_datetime = existing_data[0]['datetime']
-                    await fetch_initial_data(symbol, timeframe, latest_datetime, config, args.batch_size)
+    try:
+        if args.test_gaps:
+            end_date = args.end_date or datetime.now().isoformat()
+            for symbol in symbols:
+                await run_gap_test_and_fill(symbol, args.start_date, end_date, config, timeframes, args.log_level)
+        elif args.fetch_initial_data:
+            await run_backfill(symbols, timeframes, args.start_date, config, args.batch_size)
+        else:
+            try:
+                if args.workers > 1:
+                    await run_sharded(symbols, timeframes, args.start_date, config, args.workers, dashboard=not (args.no_dashboard or args.headless), metrics=args.headless, log_level=args.log_level)
                 else:
-                    await fetch_initial_data(symbol, timeframe, args.start_date, config, args.batch_size)
-    else:
-        try:
-            await start_websocket_connections(symbols, timeframes, args.start_date, config)
-        except KeyboardInterrupt:
-            logger.info("Received keyboard interrupt, shutting down...")
-        finally:
-            # Cancel all running tasks
-            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-            [task.cancel() for task in tasks]
-            await asyncio.gather(*tasks, return_exceptions=True)
-            logger.info("All tasks have been cancelled")
+                    await start_websocket_connections(symbols, timeframes, args.start_date, config, dashboard=not (args.no_dashboard or args.headless), metrics=args.headless)
+            except KeyboardInterrupt:
+                logger.info("Received keyboard interrupt, shutting down...")
+            finally:
+                # Cancel all running tasks
+                tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+                [task.cancel() for task in tasks]
+                await asyncio.gather(*tasks, return_exceptions=True)
+                logger.info("All tasks have been cancelled")
+    finally:
+        if summary_task is not None:
+            summary_task.cancel()
+        if args.trace:
+            TRACER.write_trace(args.trace)
+        await logger.complete()
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     main_task = asyncio.ensure_future(main())
     
+    # SIGUSR1 starts and stops a cProfile capture of the running event loop
+    ProfileSwitch().install(loop)
+
     # Add signal handlers
     for signame in ('SIGINT', 'SIGTERM'):
         loop.add_signal_handler(getattr(signal, signame),
@@ -0,0 +1,185 @@
+import bisect
+import math
+from aiohttp import web
+from loguru import logger
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonically increasing value per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _label_text(self.labels, key), value
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[tuple(str(labels[name]) for name in self.labels)] = value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets)
+        self.labels = tuple(labels)
+        self.values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[index] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def quantile(self, q, **labels):
+        """Estimate a quantile from the buckets the way Prometheus' histogram_quantile does."""
+        entry = self.values.get(tuple(str(labels[name]) for name in self.labels))
+        if entry is None or entry[-1] == 0:
+            return math.nan
+        rank = q * entry[-1]
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, entry):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+    def samples(self):
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                yield f"{self.name}_bucket", _label_text(self.labels + ('le',), key + (bound,)), cumulative
+            yield f"{self.name}_bucket", _label_text(self.labels + ('le',), key + ('+Inf',)), entry[-1]
+            yield f"{self.name}_sum", _label_text(self.labels, key), entry[-2]
+            yield f"{self.name}_count", _label_text(self.labels, key), entry[-1]
+
+
+class MetricsRegistry:
+    """Holds the metrics of the process and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _register(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        return self._register(Histogram(name, help_text, buckets, labels))
+
+    def add_collector(self, collect):
+        """Register a callable that refreshes gauges right before every scrape."""
+        self.collectors.append(collect)
+
+    def _collect(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+
+    def snapshot(self):
+        """Return every metric's values as plain data ({name: {label values: value}}), e.g. to send to another process."""
+        self._collect()
+        return {
+            name: {key: list(value) if isinstance(value, list) else value for key, value in metric.values.items()}
+            for name, metric in self.metrics.items()
+        }
+
+    def load(self, snapshots):
+        """
+        Replace every metric's values with the sum of `snapshots` taken by `snapshot`.
+
+        Used by the coordinator of a sharded run to serve the totals of its
+        workers: counters and histogram buckets add up, and so do the gauges
+        (queue depths, cache sizes) since each worker owns its share.
+        """
+        for name, metric in self.metrics.items():
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(name, {}).items():
+                    if isinstance(value, list):
+                        merged[key] = [total + part for total, part in zip(merged.get(key, [0] * len(value)), value)]
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+            metric.values = merged
+
+    def render(self):
+        self._collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value if math.isfinite(value) else 'NaN'}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+WS_MESSAGES = REGISTRY.counter('bybit_ws_klines_total', 'Kline updates received over WebSocket', ['symbol', 'timeframe'])
+WS_RECONNECTS = REGISTRY.counter('bybit_ws_reconnects_total', 'WebSocket reconnects', ['connection'])
+REST_REQUESTS = REGISTRY.counter('bybit_rest_requests_total', 'Bybit REST requests by outcome', ['outcome'])
+RATE_LIMIT_WAITS = REGISTRY.counter('bybit_rate_limit_waits_total', 'Requests that waited on the rate limiter')
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.counter('bybit_rate_limit_wait_seconds_total', 'Time spent waiting on the rate limiter')
+KLINE_CACHE_REQUESTS = REGISTRY.counter('kline_cache_requests_total', 'Kline page lookups by outcome (hit, miss, coalesced)', ['outcome'])
+KLINE_CACHE_BYTES = REGISTRY.gauge('kline_cache_bytes', 'Bytes held by the kline page cache')
+QUEUE_DEPTH = REGISTRY.gauge('pipeline_queue_depth', 'Items waiting in each live pipeline stage', ['stage'])
+WRITE_BATCH_ROWS = REGISTRY.histogram('candle_write_batch_rows', 'Rows per database write batch', [1, 10, 100, 1000, 10000, 100000])
+COMMIT_LATENCY = REGISTRY.histogram('kline_commit_latency_seconds', 'Time from the Bybit kline timestamp to the database commit', [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60])
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Serve `registry` at http://host:port/metrics; returns the runner to clean up on shutdown."""
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import math
+import random
+import time
+import websockets
+from aiohttp import web, WSMsgType
+from loguru import logger
+
+from timeframes import MAX_KLINES_PER_REQUEST, add_candles, align_open, timeframe_ms
+
+
+def synthetic_candle(symbol, timeframe, start_ms):
+    """Deterministic OHLCV values for a candle, so repeated requests return the same data."""
+    base = 100 + (sum(map(ord, symbol)) % 50) * 10
+    phase = start_ms / 3_600_000
+    close = base * (1 + 0.05 * math.sin(phase / 7) + 0.01 * math.sin(phase * 3.1))
+    open_ = base * (1 + 0.05 * math.sin((phase - 0.01) / 7) + 0.01 * math.sin((phase - 0.01) * 3.1))
+    spread = base * 0.002
+    volume = 10 + (start_ms // 60000) % 97
+    return open_, max(open_, close) + spread, min(open_, close) - spread, close, volume
+
+
+class MockBybitRest:
+    """
+    Local stand-in for Bybit's `/v5/market/kline` endpoint.
+
+    Serves synthetic candles newest first (like Bybit), after `latency` seconds,
+    and answers a share `error_rate` of the requests with HTTP 429.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rejected = 0
+
+    async def handle_kline(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.rejected += 1
+            return web.Response(status=429, text="Too many visits")
+
+        query = request.query
+        symbol, timeframe = query['symbol'], query['interval']
+        start_ms, end_ms = int(query['start']), int(query['end'])
+        end_ms = min(end_ms, int(time.time() * 1000))
+        limit = min(int(query.get('limit', 200)), MAX_KLINES_PER_REQUEST)
+
+        opens = []
+        current = align_open(end_ms, timeframe)
+        while current >= start_ms and len(opens) < limit:
+            opens.append(current)
+            current = add_candles(current, timeframe, -1)
+        rows = []
+        for start in opens:
+            open_, high, low, close, volume = synthetic_candle(symbol, timeframe, start)
+            rows.append([str(start), f"{open_:.4f}", f"{high:.4f}", f"{low:.4f}", f"{close:.4f}", f"{volume:.2f}", f"{volume * close:.2f}"])
+        return web.json_response({'retCode': 0, 'retMsg': 'OK', 'result': {'symbol': symbol, 'category': 'linear', 'list': rows}})
+
+
+def synthetic_stream(symbols, timeframes, candles=60, ticks_per_candle=20, start_ms=None):
+    """
+    Build a kline message sequence like Bybit's public stream.
+
+    Every stream gets `ticks_per_candle` in-progress updates per candle followed
+    by the confirmed candle. The `ts` field is the market time of each message.
+    """
+    start_ms = start_ms if start_ms is not None else align_open(int(time.time() * 1000), '1') - candles * 60000
+    messages = []
+    step = 60000 // ticks_per_candle
+    for candle in range(candles):
+        for tick in range(ticks_per_candle + 1):
+            ts = start_ms + candle * 60000 + tick * step
+            confirmed = tick == ticks_per_candle
+            for symbol in symbols:
+                for timeframe in timeframes:
+                    length = timeframe_ms(timeframe) or 60000
+                    open_ms = align_open(ts - (1 if confirmed else 0), timeframe)
+                    if confirmed and add_candles(open_ms, timeframe, 1) != ts:
+                        continue
+                    open_, high, low, close, volume = synthetic_candle(symbol, timeframe, ts)
+                    messages.append({
+                        'topic': f"kline.{timeframe}.{symbol}",
+                        'type': 'snapshot',
+                        'ts': ts,
+                        'data': [{
+                            'start': open_ms,
+                            'end': open_ms + length - 1,
+                            'interval': timeframe,
+                            'open': f"{open_:.4f}",
+                            'close': f"{close:.4f}",
+                            'high': f"{high:.4f}",
+                            'low': f"{low:.4f}",
+                            'volume': f"{volume:.2f}",
+                            'turnover': f"{volume * close:.2f}",
+                            'confirm': confirmed,
+                            'timestamp': ts,
+                        }],
+                    })
+    return messages
+
+
+def load_capture(path):
+    """Load a capture written by `record_stream`: one raw WebSocket message (JSON) per line."""
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+async def record_stream(url, topics, path, seconds):
+    """Record the raw kline messages of `topics` from a live Bybit socket for replay."""
+    count = 0
+    deadline = time.monotonic() + seconds
+    async with websockets.connect(url) as ws:
+        for i in range(0, len(topics), 10):
+            await ws.send(json.dumps({'op': 'subscribe', 'args': topics[i:i + 10]}))
+        with open(path, 'w') as handle:
+            while time.monotonic() < deadline:
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=max(deadline - time.monotonic(), 0.01))
+                except asyncio.TimeoutError:
+                    break
+                if '"topic"' in message:
+                    handle.write(message + '\n')
+                    count += 1
+    logger.info(f"Recorded {count} messages to {path}")
+    return count
+
+
+class MockBybitWebSocket:
+    """
+    Replays kline messages to subscribers of a local WebSocket endpoint.
+
+    Each connection gets the messages of the topics it subscribed to, spaced by
+    their original `ts` divided by `speed` (0 sends them as fast as possible).
+    `ts` and the kline `timestamp` are rewritten to the send time, so latency
+    measured downstream starts when the message leaves the replayer.
+    """
+
+    def __init__(self, messages, speed=1.0, subscribe_wait=0.5):
+        self.messages = messages
+        self.speed = speed
+        self.subscribe_wait = subscribe_wait
+        self.sent = 0
+        self.finished = asyncio.Event()
+        self._replays = []
+
+    async def _replay(self, ws, topics):
+        selected = [message for message in self.messages if message['topic'] in topics]
+        if not selected:
+            return
+        first_ts = selected[0]['ts']
+        started = time.monotonic()
+        for message in selected:
+            if self.speed:
+                delay = (message['ts'] - first_ts) / 1000 / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            now_ms = int(time.time() * 1000)
+            message = dict(message, ts=now_ms, data=[dict(kline, timestamp=now_ms) for kline in message['data']])
+            await ws.send_str(json.dumps(message))
+            self.sent += 1
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        topics = set()
+        replay = None
+
+        async def start_replay():
+            # Give every subscribe message of the connection a moment to arrive
+            await asyncio.sleep(self.subscribe_wait)
+            await self._replay(ws, topics)
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            data = json.loads(message.data)
+            if data.get('op') == 'subscribe':
+                topics.update(data.get('args', []))
+                await ws.send_str(json.dumps({'success': True, 'ret_msg': '', 'op': 'subscribe', 'req_id': data.get('req_id')}))
+                if replay is None:
+                    replay = asyncio.create_task(start_replay())
+                    self._replays.append(replay)
+                    replay.add_done_callback(lambda _: self._check_finished())
+            elif data.get('op') == 'ping':
+                await ws.send_str(json.dumps({'success': True, 'ret_msg': 'pong', 'op': 'ping'}))
+        if replay is not None:
+            replay.cancel()
+        return ws
+
+    def _check_finished(self):
+        if all(task.done() for task in self._replays):
+            self.finished.set()
+
+
+async def start_mock_bybit(rest=None, ws=None, host='127.0.0.1', port=8765):
+    """
+    Serve the mocks on one port: REST at /v5/market/kline and WebSocket at /v5/public/linear.
+
+    :return: The aiohttp runner; call `cleanup()` to stop it.
+    """
+    app = web.Application()
+    if rest is not None:
+        app.router.add_get('/v5/market/kline', rest.handle_kline)
+    if ws is not None:
+        app.router.add_get('/v5/public/linear', ws.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.debug(f"Mock Bybit listening on {host}:{port}")
+    return runner
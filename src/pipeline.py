@@ -0,0 +1,271 @@
+import asyncio
+from collections import deque
+from loguru import logger
+
+from candle import Candle
+from data_fetcher import upsert_klines_websocket
+from decoding import loads
+from metrics import QUEUE_DEPTH, WS_MESSAGES
+from resampler import BASE_TIMEFRAME
+from timeframes import normalize_timeframe
+from tracing import traced
+from ws_manager import parse_topic
+
+
+@traced('parse_kline_message')
+def parse_kline_message(message):
+    """
+    Decode one WebSocket message.
+
+    :return: A list of (symbol, timeframe, kline) tuples with the raw Bybit kline
+        dicts; empty for subscription acks, pongs and anything that is not a kline push.
+    """
+    data = loads(message)
+    if 'topic' not in data:
+        if data.get('op') == 'subscribe':
+            if data.get('success'):
+                logger.debug("Successfully subscribed: {}", data)
+            else:
+                logger.error(f"Subscription failed: {data}")
+        elif data.get('op') != 'ping':
+            logger.warning("Received unexpected message format: {}", message)
+        return []
+
+    symbol, timeframe = parse_topic(data['topic'])
+    return [(symbol, timeframe, kline) for kline in data.get('data', [])]
+
+
+class KlineCoalescer:
+    """
+    Keeps only the newest in-progress kline of every stream until the next refresh.
+
+    Bybit pushes several unconfirmed updates per second for each open candle,
+    but only the latest one matters to the dashboard, so they are held here as
+    raw dicts and released once per `interval`. Confirmed klines are not held
+    at all. Work downstream of this scales with streams x refresh rate instead
+    of with the exchange's message rate.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.latest = {}
+        self.received = 0
+
+    def offer(self, key, kline):
+        """Hold an unconfirmed kline, or return True when `kline` is confirmed and must pass straight through."""
+        self.received += 1
+        if kline['confirm']:
+            pending = self.latest.get(key)
+            # A pending tick of this (or an earlier) candle is stale once it is confirmed
+            if pending is not None and int(pending['start']) <= int(kline['start']):
+                del self.latest[key]
+            return True
+        self.latest[key] = kline
+        return False
+
+    def take(self):
+        """Return and forget the held klines as {key: kline}."""
+        latest, self.latest = self.latest, {}
+        return latest
+
+
+class StreamQueue:
+    """
+    Bounded queue between two pipeline stages that merges in-progress kline updates.
+
+    Confirmed updates wait for room (backpressure) and are never lost. An
+    in-progress update replaces the one still waiting for the same stream, and
+    is dropped when the queue is full, since a newer tick is always on its way.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.merged = 0
+        self.dropped = 0
+        self._items = deque()  # [key, item] slots; a slot whose item is None was superseded
+        self._pending = {}  # key -> slot of the in-progress update waiting in _items
+        self._changed = asyncio.Condition()
+
+    def qsize(self):
+        return len(self._items)
+
+    async def put(self, key, item, confirmed):
+        async with self._changed:
+            if not confirmed:
+                slot = self._pending.get(key)
+                if slot is not None:
+                    slot[1] = item
+                    self.merged += 1
+                    return
+                if len(self._items) >= self.maxsize:
+                    self.dropped += 1
+                    return
+                slot = self._pending[key] = [key, item]
+            else:
+                # The candle is final now, so an older in-progress view of it is stale
+                stale = self._pending.pop(key, None)
+                if stale is not None:
+                    stale[1] = None
+                await self._changed.wait_for(lambda: len(self._items) < self.maxsize)
+                slot = [key, item]
+            self._items.append(slot)
+            self._changed.notify_all()
+
+    async def get(self):
+        async with self._changed:
+            while True:
+                await self._changed.wait_for(lambda: self._items)
+                slot = self._items.popleft()
+                self._changed.notify_all()
+                key, item = slot
+                if self._pending.get(key) is slot:
+                    del self._pending[key]
+                if item is not None:
+                    return key, item
+
+
+class LivePipeline:
+    """
+    Staged processing of live kline messages: receive -> parse -> coalesce -> indicators -> persist -> display.
+
+    The socket readers of `ws_manager` fill `source`; every other stage runs in
+    its own tasks and the stages are joined by bounded queues, so slow storage
+    or rendering only backs up its own queue and never stalls the readers.
+    Parsing and indicators keep one worker each because indicator state depends
+    on message order; persistence can use several. In-progress candles are
+    held by a `KlineCoalescer` and only released once per refresh.
+    """
+
+    def __init__(self, source, engine, writer, display=None, queue_size=1000, persist_workers=2, refresh_interval=1.0, health=None, resamplers=None):
+        """
+        :param resamplers: Optional {symbol: resampler.CandleResampler}; their higher timeframes
+            are built from the symbol's 1-minute candles and processed like subscribed streams.
+        """
+        self.source = source
+        self.engine = engine
+        self.writer = writer
+        self.display = display
+        self.health = health
+        self.resamplers = resamplers or {}
+        self.persist_workers = persist_workers
+        self.coalescer = KlineCoalescer(refresh_interval)
+        self.indicator_queue = StreamQueue(queue_size)
+        self.persist_queue = asyncio.Queue(maxsize=queue_size)
+        self.display_queue = StreamQueue(queue_size)
+        self.confirmed_starts = {}
+        self.tasks = []
+
+    async def _parse(self):
+        while True:
+            message = await self.source.get()
+            try:
+                for symbol, timeframe, kline in parse_kline_message(message):
+                    key = (symbol, timeframe)
+                    WS_MESSAGES.inc(symbol=symbol, timeframe=timeframe)
+                    if self.coalescer.offer(key, kline):
+                        await self.indicator_queue.put(key, Candle.from_ws(kline), True)
+            except Exception as e:
+                logger.error(f"Error parsing kline message: {e}")
+
+    async def _coalesce(self):
+        while True:
+            await asyncio.sleep(self.coalescer.interval)
+            for key, kline in self.coalescer.take().items():
+                try:
+                    await self.indicator_queue.put(key, Candle.from_ws(kline), False)
+                except Exception as e:
+                    logger.error(f"Error parsing kline for {key[0]} ({key[1]}): {e}")
+
+    async def _indicators(self):
+        while True:
+            (symbol, timeframe), candle = await self.indicator_queue.get()
+            last_confirmed = self.confirmed_starts.get((symbol, timeframe), -1)
+            if candle.start < last_confirmed or (not candle.confirmed and candle.start == last_confirmed):
+                # Released by the coalescer just before its candle was confirmed, or already caught up over REST
+                continue
+            await self._process(symbol, timeframe, candle)
+            resampler = self.resamplers.get(symbol) if timeframe == BASE_TIMEFRAME else None
+            if resampler is not None:
+                for derived_timeframe, derived in resampler.update(candle):
+                    await self._process(symbol, derived_timeframe, derived)
+
+    def last_confirmed(self, symbol, timeframe):
+        """Open time of the newest confirmed candle of a stream, falling back to its indicator warmup."""
+        last_start = self.confirmed_starts.get((symbol, timeframe))
+        if last_start is None:
+            last_start = self.engine.state(symbol, normalize_timeframe(timeframe)).last_start
+        return last_start
+
+    async def submit(self, symbol, timeframe, candles):
+        """Queue confirmed candles (e.g. a `candle.CandleBatch` from a REST catch-up) for the indicator stage, in order."""
+        for index in range(len(candles)):
+            await self.indicator_queue.put((symbol, timeframe), candles[index], True)
+
+    async def _process(self, symbol, timeframe, candle):
+        if candle.confirmed:
+            self.confirmed_starts[(symbol, timeframe)] = candle.start
+            if self.health is not None:
+                self.health.record(symbol, timeframe, candle.start)
+        try:
+            # Indicators come from the per-stream state; only completed candles advance it
+            self.engine.apply(symbol, timeframe, candle)
+            if candle.confirmed:
+                await self.persist_queue.put((symbol, timeframe, candle))
+            if self.display is not None:
+                await self.display_queue.put((symbol, timeframe), candle, candle.confirmed)
+        except Exception as e:
+            logger.error(f"Error computing indicators for {symbol} ({timeframe}): {e}")
+
+    async def _persist(self):
+        while True:
+            symbol, timeframe, candle = await self.persist_queue.get()
+            try:
+                await upsert_klines_websocket(self.writer, [candle], symbol, timeframe)
+                logger.debug("Upserted completed kline data for {} ({})", symbol, timeframe)
+            finally:
+                self.persist_queue.task_done()
+
+    async def _display(self):
+        while True:
+            (symbol, timeframe), candle = await self.display_queue.get()
+            try:
+                await self.display(symbol, timeframe, candle)
+            except Exception as e:
+                logger.error(f"Error updating the display for {symbol} ({timeframe}): {e}")
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._parse()), asyncio.create_task(self._coalesce()), asyncio.create_task(self._indicators())]
+        self.tasks += [asyncio.create_task(self._persist()) for _ in range(self.persist_workers)]
+        if self.display is not None:
+            self.tasks.append(asyncio.create_task(self._display()))
+        return self
+
+    def depths(self):
+        """Current length of every stage's input queue."""
+        return {
+            'receive': self.source.qsize(),
+            'indicators': self.indicator_queue.qsize(),
+            'persist': self.persist_queue.qsize(),
+            'display': self.display_queue.qsize(),
+        }
+
+    def collect_metrics(self):
+        for stage, depth in self.depths().items():
+            QUEUE_DEPTH.set(depth, stage=stage)
+
+    async def run(self):
+        """Run until cancelled or until one of the stage tasks fails."""
+        await asyncio.gather(*self.tasks)
+
+    async def close(self):
+        """Stop the stages, handing every confirmed candle that was already computed to the writer first."""
+        upstream, downstream = self.tasks[:3], self.tasks[3:]
+        for task in upstream:
+            task.cancel()
+        await asyncio.gather(*upstream, return_exceptions=True)
+        if any(not task.done() for task in downstream):
+            await self.persist_queue.join()
+        for task in downstream:
+            task.cancel()
+        await asyncio.gather(*downstream, return_exceptions=True)
+        self.tasks = []
@@ -0,0 +1,171 @@
+import numpy as np
+
+from candle import Candle
+from decoding import KLINE_DTYPE
+from gap_detection import candle_indices
+from timeframes import MINUTE_MS, WEEK_MS, WEEK_OFFSET_MS, add_candles, align_open, normalize_timeframe, timeframe_ms
+
+BASE_TIMEFRAME = '1'
+
+
+def derived_timeframes(timeframes):
+    """Return the normalized timeframes that are built from the 1-minute series, i.e. all but "1"."""
+    return [timeframe for timeframe in dict.fromkeys(map(normalize_timeframe, timeframes)) if timeframe != BASE_TIMEFRAME]
+
+
+def bucket_opens(starts, timeframe):
+    """Vectorized `timeframes.align_open`: the open time of the `timeframe` candle containing each 1-minute open."""
+    indices = candle_indices(starts, timeframe)
+    step = timeframe_ms(timeframe)
+    if step is None:
+        return indices.astype('datetime64[M]').astype('datetime64[ms]').astype(np.int64)
+    offset = WEEK_OFFSET_MS if step == WEEK_MS else 0
+    return indices * step + offset
+
+
+def resample(klines, timeframe):
+    """
+    Aggregate 1-minute candles into `timeframe` candles in one vectorized pass.
+
+    Buckets follow Bybit's alignment: fixed lengths from the epoch, weeks from
+    Monday 00:00 UTC and calendar months for "M".
+
+    :param klines: Structured array with start, open, high, low, close and volume fields (and
+        optionally turnover), ordered oldest first.
+    :param timeframe: The target timeframe.
+    :return: A `decoding.KLINE_DTYPE` array with one row per bucket that has any minute in `klines`.
+    """
+    if not len(klines):
+        return np.empty(0, dtype=KLINE_DTYPE)
+    opens = bucket_opens(klines['start'], timeframe)
+    first = np.concatenate(([0], np.flatnonzero(np.diff(opens)) + 1))
+    last = np.append(first[1:], len(klines)) - 1
+
+    candles = np.empty(len(first), dtype=KLINE_DTYPE)
+    candles['start'] = opens[first]
+    candles['open'] = klines['open'][first]
+    candles['high'] = np.maximum.reduceat(klines['high'], first)
+    candles['low'] = np.minimum.reduceat(klines['low'], first)
+    candles['close'] = klines['close'][last]
+    candles['volume'] = np.add.reduceat(klines['volume'], first)
+    candles['turnover'] = np.add.reduceat(klines['turnover'], first) if 'turnover' in klines.dtype.names else np.nan
+    return candles
+
+
+class BackfillResampler:
+    """
+    Builds the higher-timeframe candles of one symbol from its backfilled 1-minute pages.
+
+    Pages must be fed oldest first and without holes between them, as the
+    backfill indicator stage releases them. Only finished buckets are returned;
+    the minutes of the newest bucket are held until the rest arrive or `finish`
+    is called. Buckets that open before `start_ms` are partial and dropped.
+    """
+
+    def __init__(self, timeframes, start_ms=None):
+        self.timeframes = derived_timeframes(timeframes)
+        self.start_ms = start_ms
+        self.pending = {timeframe: np.empty(0, dtype=KLINE_DTYPE) for timeframe in self.timeframes}
+
+    def _complete(self, candles):
+        return candles if self.start_ms is None else candles[candles['start'] >= self.start_ms]
+
+    def feed(self, klines):
+        """Add 1-minute candles; returns {timeframe: KLINE_DTYPE array of finished buckets}."""
+        finished = {}
+        if not len(klines):
+            return finished
+        klines = _as_klines(klines)
+        for timeframe in self.timeframes:
+            series = np.concatenate((self.pending[timeframe], klines))
+            candles = resample(series, timeframe)
+            newest = int(candles['start'][-1])
+            if int(series['start'][-1]) + MINUTE_MS < add_candles(newest, timeframe, 1):
+                # The newest bucket is still missing minutes
+                self.pending[timeframe] = series[series['start'] >= newest]
+                candles = candles[:-1]
+            else:
+                self.pending[timeframe] = series[:0]
+            finished[timeframe] = self._complete(candles)
+        return finished
+
+    def finish(self):
+        """Return the partial newest bucket of every timeframe (the candle still in progress)."""
+        partial = {timeframe: self._complete(resample(pending, timeframe)) for timeframe, pending in self.pending.items()}
+        self.pending = {timeframe: pending[:0] for timeframe, pending in self.pending.items()}
+        return partial
+
+
+def _as_klines(candles):
+    """Copy the price fields of a structured candle array (e.g. `candle.CANDLE_DTYPE`) into `KLINE_DTYPE`."""
+    if candles.dtype == KLINE_DTYPE:
+        return candles
+    klines = np.empty(len(candles), dtype=KLINE_DTYPE)
+    for name in KLINE_DTYPE.names:
+        klines[name] = candles[name] if name in candles.dtype.names else np.nan
+    return klines
+
+
+class CandleResampler:
+    """
+    Incrementally builds the live higher-timeframe candles of one symbol from its 1-minute candles.
+
+    Confirmed minutes are folded into a running bucket per timeframe; an
+    in-progress minute is combined with it without changing it. A bucket is
+    confirmed with its last minute, or when a minute of the next bucket
+    arrives first.
+    """
+
+    def __init__(self, timeframes):
+        self.timeframes = derived_timeframes(timeframes)
+        self.buckets = {}  # timeframe -> [open_ms, open, high, low, close, volume] of the confirmed minutes
+        self.last_minute = None
+
+    def seed(self, klines):
+        """Fold in the confirmed 1-minute candles (oldest first) of the buckets that are still open."""
+        klines = _as_klines(klines)
+        if not len(klines):
+            return
+        self.last_minute = int(klines['start'][-1])
+        for timeframe in self.timeframes:
+            start, open_, high, low, close, volume, _ = resample(klines, timeframe)[-1].tolist()
+            if self.last_minute + MINUTE_MS < add_candles(start, timeframe, 1):
+                self.buckets[timeframe] = [start, open_, high, low, close, volume]
+
+    def update(self, candle):
+        """
+        Fold a 1-minute `candle.Candle` into the buckets.
+
+        :return: A list of (timeframe, Candle) updates, including confirmations of buckets that just closed.
+        """
+        if candle.confirmed and self.last_minute is not None and candle.start <= self.last_minute:
+            # Already counted, e.g. a repeated confirmation or a minute covered by the seed
+            return []
+        updates = []
+        for timeframe in self.timeframes:
+            bucket_open = align_open(candle.start, timeframe)
+            bucket = self.buckets.get(timeframe)
+            if bucket is not None and bucket[0] != bucket_open:
+                if bucket[0] > bucket_open:
+                    continue
+                # The previous bucket never saw its last minute (e.g. after a reconnect); close it as it is
+                updates.append((timeframe, _bucket_candle(bucket, candle.timestamp, True)))
+                bucket = None
+            if bucket is None:
+                combined = [bucket_open, candle.open, candle.high, candle.low, candle.close, candle.volume]
+            else:
+                combined = [bucket_open, bucket[1], max(bucket[2], candle.high), min(bucket[3], candle.low), candle.close, bucket[5] + candle.volume]
+            closes = candle.confirmed and candle.start + MINUTE_MS >= add_candles(bucket_open, timeframe, 1)
+            if candle.confirmed and not closes:
+                self.buckets[timeframe] = combined
+            elif closes or bucket is None:
+                self.buckets.pop(timeframe, None)
+            updates.append((timeframe, _bucket_candle(combined, candle.timestamp, closes)))
+        if candle.confirmed:
+            self.last_minute = candle.start
+        return updates
+
+
+def _bucket_candle(bucket, timestamp, confirmed):
+    start, open_, high, low, close, volume = bucket
+    return Candle(start, open_, high, low, close, volume, timestamp, confirmed)
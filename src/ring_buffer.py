@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from loguru import logger
+
+CANDLE_DTYPE = np.dtype([
+    ('ts', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+MAGIC = 0x4B4C494E45524E47  # "KLINERNG"
+# Header: magic, capacity, start, end (int64 each)
+HEADER = np.dtype([('magic', '<i8'), ('capacity', '<i8'), ('start', '<i8'), ('end', '<i8')])
+
+
+class CandleRingBuffer:
+    """
+    Fixed-capacity buffer of the most recent candles of one stream, backed by a memory-mapped file.
+
+    The file holds room for twice the capacity. Appends go to the end and, once
+    that space runs out, the newest `capacity` rows are moved back to the
+    start, so `view()` is always one contiguous slice (no copy) and appends stay
+    O(1) amortized. There must be a single writer; other processes can open
+    the same file read-only to follow the series.
+    """
+
+    def __init__(self, path, capacity=1000, readonly=False):
+        self.path = path
+        exists = os.path.exists(path)
+        if readonly and not exists:
+            raise FileNotFoundError(path)
+        if not exists:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._create(capacity)
+        mode = 'r' if readonly else 'r+'
+        self.header = np.memmap(path, dtype=HEADER, mode=mode, shape=(1,))
+        if int(self.header['magic'][0]) != MAGIC:
+            raise ValueError(f"{path} is not a candle ring buffer")
+        self.capacity = int(self.header['capacity'][0])
+        self.data = np.memmap(path, dtype=CANDLE_DTYPE, mode=mode, offset=HEADER.itemsize, shape=(2 * self.capacity,))
+
+    def _create(self, capacity):
+        with open(self.path, 'wb') as handle:
+            header = np.zeros(1, dtype=HEADER)
+            header['magic'], header['capacity'] = MAGIC, capacity
+            handle.write(header.tobytes())
+            handle.truncate(HEADER.itemsize + 2 * capacity * CANDLE_DTYPE.itemsize)
+
+    def __len__(self):
+        return int(self.header['end'][0] - self.header['start'][0])
+
+    def view(self):
+        """Return the buffered candles, oldest first, as a zero-copy structured array view."""
+        return self.data[int(self.header['start'][0]):int(self.header['end'][0])]
+
+    def last(self):
+        """Return the newest candle as a structured scalar, or None when the buffer is empty."""
+        end = int(self.header['end'][0])
+        return self.data[end - 1] if end > int(self.header['start'][0]) else None
+
+    def append(self, ts, open_, high, low, close, volume):
+        """
+        Add a candle, or replace the newest one when it has the same open time.
+
+        Candles older than the newest one are ignored.
+        """
+        start, end = int(self.header['start'][0]), int(self.header['end'][0])
+        if end > start:
+            last_ts = int(self.data['ts'][end - 1])
+            if ts == last_ts:
+                self.data[end - 1] = (ts, open_, high, low, close, volume)
+                return
+            if ts < last_ts:
+                return
+        if end == len(self.data):
+            # Out of room: move the newest capacity - 1 rows back to the front
+            keep = self.capacity - 1
+            self.data[:keep] = self.data[end - keep:end]
+            start, end = 0, keep
+        self.data[end] = (ts, open_, high, low, close, volume)
+        end += 1
+        start = max(start, end - self.capacity)
+        # Publish the new row before moving the header
+        self.header['start'], self.header['end'] = start, end
+
+    def reset(self, candles=()):
+        """Drop the buffered candles and refill the buffer with (ts, open, high, low, close, volume) tuples."""
+        self.header['start'], self.header['end'] = 0, 0
+        for candle in list(candles)[-self.capacity:]:
+            self.append(*candle)
+
+    def flush(self):
+        self.data.flush()
+        self.header.flush()
+
+
+class RingBufferStore:
+    """One `CandleRingBuffer` per (symbol, timeframe) under a directory."""
+
+    def __init__(self, root, capacity=1000):
+        self.root = root
+        self.capacity = capacity
+        self.buffers = {}
+
+    def path(self, symbol, timeframe):
+        return os.path.join(self.root, f"{symbol}_{timeframe}.ring")
+
+    def get(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.buffers:
+            self.buffers[key] = CandleRingBuffer(self.path(symbol, timeframe), self.capacity)
+        return self.buffers[key]
+
+    def recent(self, symbol, timeframe, limit):
+        """Return the newest `limit` buffered candles as (start_ms, open, high, low, close, volume) tuples, oldest first."""
+        if not os.path.exists(self.path(symbol, timeframe)):
+            return []
+        return self.get(symbol, timeframe).view()[-limit:].tolist()
+
+    def append(self, symbol, timeframe, ts, open_, high, low, close, volume):
+        self.get(symbol, timeframe).append(ts, open_, high, low, close, volume)
+
+    def replace(self, symbol, timeframe, candles):
+        self.get(symbol, timeframe).reset(candles)
+
+    def flush(self):
+        for buffer in self.buffers.values():
+            buffer.flush()
+
+
+def create_ring_buffer_store(config):
+    """Return the ring buffer store configured by RING_BUFFER_DIR, or None when it is disabled."""
+    if not config.RING_BUFFER_DIR:
+        return None
+    logger.debug(f"Keeping recent candles in memory-mapped ring buffers under {config.RING_BUFFER_DIR}")
+    return RingBufferStore(config.RING_BUFFER_DIR, config.RING_BUFFER_CAPACITY)
@@ -0,0 +1,239 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from loguru import logger
+from rich.console import Console
+from rich.live import Live
+
+from candle import Candle
+from dashboard import DashboardModel
+from log_setup import setup_logger
+from metrics import REGISTRY, start_metrics_server
+from websocket_handler import start_websocket_connections
+
+console = Console()
+
+
+def shard_symbols(symbols, workers):
+    """Split `symbols` round-robin into at most `workers` non-empty shards."""
+    return [shard for shard in (symbols[index::workers] for index in range(workers)) if shard]
+
+
+def shard_config(config, workers):
+    """Copy of `config` for one of `workers` processes; they share the IP's REST limit."""
+    return config.model_copy(update={'BYBIT_REST_RATE_LIMIT': max(1, config.BYBIT_REST_RATE_LIMIT // workers)})
+
+
+class StatusReporter:
+    """
+    Worker side of a sharded run: forwards what the dashboard and metrics need to the coordinator.
+
+    The newest candle of every stream is kept as a plain tuple and only the
+    streams that changed are sent, together with the health flags and a
+    metrics snapshot, once per `interval`. A message is a small dict, so the
+    queue costs little compared with the messages the worker processes.
+    """
+
+    def __init__(self, shard, status_queue, interval=1.0):
+        self.shard = shard
+        self.status_queue = status_queue
+        self.interval = interval
+        self.changed = {}
+        self.monitor = None
+        self._task = None
+
+    async def display(self, symbol, timeframe, candle):
+        self.changed[(symbol, timeframe)] = (candle.start, candle.open, candle.high, candle.low, candle.close, candle.volume)
+
+    def report(self):
+        changed, self.changed = self.changed, {}
+        self.status_queue.put({
+            'shard': self.shard,
+            'candles': changed,
+            'health': dict(self.monitor.healthy) if self.monitor is not None else {},
+            'metrics': REGISTRY.snapshot(),
+        })
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.report()
+            except Exception as e:
+                logger.error(f"Shard {self.shard}: could not report status: {e}")
+
+    def start(self, monitor=None):
+        self.monitor = monitor
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        """Stop reporting after one last report, so the coordinator sees the final counts."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self.report()
+
+
+async def _wait_for_stop(stop, parent_pid):
+    # Also stop when the coordinator is gone, so no worker is left behind
+    while not stop.is_set() and os.getppid() == parent_pid:
+        await asyncio.sleep(0.5)
+
+
+async def _serve_shard(shard, symbols, timeframes, start_date, config, status_queue, stop, parent_pid):
+    reporter = StatusReporter(shard, status_queue, config.DASHBOARD_REFRESH_INTERVAL)
+    live = asyncio.create_task(start_websocket_connections(symbols, timeframes, start_date, config, dashboard=False, reporter=reporter))
+    stopped = asyncio.create_task(_wait_for_stop(stop, parent_pid))
+    await asyncio.wait({live, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    for task in (live, stopped):
+        task.cancel()
+    # Cancelling the live task runs its cleanup, which flushes the writer
+    results = await asyncio.gather(live, stopped, return_exceptions=True)
+    if isinstance(results[0], Exception):
+        logger.error(f"Shard {shard} failed: {results[0]}")
+    await logger.complete()
+
+
+def run_worker(shard, symbols, timeframes, start_date, config, status_queue, stop, parent_pid, log_level, log_file, log_console):
+    """Entry point of a worker process: the live mode for `symbols` with its own sockets, indicators and writer."""
+    # The coordinator decides when workers stop; Ctrl+C reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logger(log_level, log_file=log_file.format(shard=shard) if log_file else None, console=log_console)
+    logger.info(f"Shard {shard} (pid {os.getpid()}) streaming {len(symbols)} symbols")
+    asyncio.run(_serve_shard(shard, symbols, timeframes, start_date, config, status_queue, stop, parent_pid))
+
+
+class ShardCoordinator:
+    """
+    Runs the live mode in one worker process per shard of the symbol list.
+
+    Every worker owns its sockets, indicator state and write batcher, so the
+    parsing, indicator and database work spreads over as many cores as there
+    are workers. The coordinator only merges the workers' status messages into
+    the dashboard or the metrics endpoint, and restarts workers that exit.
+    """
+
+    def __init__(self, symbols, timeframes, start_date, config, workers, log_level='INFO', log_file='app-shard{shard}.log', poll_interval=1.0):
+        """
+        :param log_file: Log file of each worker, formatted with its shard number (None for no file).
+        """
+        self.shards = shard_symbols(symbols, workers)
+        self.symbols = symbols
+        self.timeframes = timeframes
+        self.start_date = start_date
+        self.config = config
+        self.worker_config = shard_config(config, len(self.shards))
+        self.log_level = log_level
+        self.log_file = log_file
+        self.poll_interval = poll_interval
+        # Workers are started fresh rather than forked from a process with a running event loop
+        self.context = multiprocessing.get_context('spawn')
+        self.status_queue = self.context.Queue()
+        self.stop = self.context.Event()
+        self.processes = {}
+        self.health = {}
+        self.snapshots = {}
+        self.log_console = True
+        self.restarts = 0
+
+    def _spawn(self, shard):
+        process = self.context.Process(
+            target=run_worker,
+            name=f"shard-{shard}",
+            args=(shard, self.shards[shard], self.timeframes, self.start_date, self.worker_config, self.status_queue,
+                  self.stop, os.getpid(), self.log_level, self.log_file, self.log_console),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self, log_console=True):
+        """Start the workers; `log_console=False` keeps their logs off a terminal the dashboard is drawn on."""
+        self.log_console = log_console
+        self.processes = {shard: self._spawn(shard) for shard in range(len(self.shards))}
+        logger.info(f"Started {len(self.processes)} shards: {', '.join(str(len(symbols)) for symbols in self.shards)} symbols each")
+        return self
+
+    def _apply(self, message, model):
+        if model is not None:
+            for (symbol, timeframe), values in message['candles'].items():
+                model.update(symbol, timeframe, Candle(*values))
+        self.health.update(message['health'])
+        self.snapshots[message['shard']] = message['metrics']
+
+    def _drain(self):
+        while True:
+            try:
+                message = self.status_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._apply(message, None)
+
+    def _supervise(self):
+        for shard, process in self.processes.items():
+            if not process.is_alive() and not self.stop.is_set():
+                logger.error(f"Shard {shard} exited with code {process.exitcode}, restarting it")
+                self.restarts += 1
+                self.processes[shard] = self._spawn(shard)
+
+    def _merge_metrics(self):
+        REGISTRY.load(self.snapshots.values())
+
+    def is_healthy(self, symbol, timeframe):
+        return self.health.get((symbol, timeframe), False)
+
+    async def run(self, dashboard=True, metrics=False):
+        """Collect worker status until cancelled."""
+        model = None
+        live = None
+        if dashboard:
+            model = DashboardModel(self.symbols, self.timeframes, health=self.is_healthy, symbol_filter=self.config.DASHBOARD_SYMBOLS, page_size=self.config.DASHBOARD_PAGE_SIZE)
+            live = Live(model, console=console, auto_refresh=True, refresh_per_second=1 / self.config.DASHBOARD_REFRESH_INTERVAL)
+            live.start()
+        metrics_server = None
+        if metrics:
+            REGISTRY.add_collector(self._merge_metrics)
+            metrics_server = await start_metrics_server(self.config.METRICS_HOST, self.config.METRICS_PORT)
+        try:
+            while True:
+                try:
+                    message = await asyncio.to_thread(self.status_queue.get, True, self.poll_interval)
+                except queue.Empty:
+                    message = None
+                if message is not None:
+                    self._apply(message, model)
+                self._supervise()
+        finally:
+            if live is not None:
+                live.stop()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+
+    async def close(self, timeout=15.0):
+        """Ask the workers to flush and stop, and terminate those that do not exit within `timeout` seconds."""
+        self.stop.set()
+        deadline = time.monotonic() + timeout
+        while any(process.is_alive() for process in self.processes.values()) and time.monotonic() < deadline:
+            # A worker only exits once its queued status messages are read
+            self._drain()
+            await asyncio.sleep(0.1)
+        self._drain()
+        for shard, process in self.processes.items():
+            if process.is_alive():
+                logger.warning(f"Shard {shard} did not stop in time, terminating it")
+                process.terminate()
+        self.processes = {}
+
+
+async def run_sharded(symbols, timeframes, start_date, config, workers, dashboard=True, metrics=False, log_level='INFO'):
+    """Run the live mode across `workers` processes, with the dashboard or metrics served by this one."""
+    coordinator = ShardCoordinator(symbols, timeframes, start_date, config, workers, log_level).start(log_console=not dashboard)
+    try:
+        await coordinator.run(dashboard, metrics)
+    finally:
+        await coordinator.close()
@@ -0,0 +1,388 @@
+import asyncio
+import datetime
+import sqlite3
+import time
+import asyncpg
+import numpy as np
+from loguru import logger
+from candle import CANDLE_COLUMNS, INDICATOR_COLUMNS, PRICE_COLUMNS, CandleBatch
+from metrics import COMMIT_LATENCY, WRITE_BATCH_ROWS
+from tracing import TRACER
+from supabase import create_client
+
+STAGING_TABLE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS candles_staging (
+    symbol VARCHAR(50),
+    timeframe VARCHAR(10),
+    datetime TIMESTAMP,
+    {columns}
+) ON COMMIT DELETE ROWS
+""".format(columns=',\n    '.join(f"{column} DOUBLE PRECISION" for column in PRICE_COLUMNS + INDICATOR_COLUMNS))
+
+# Indicator columns keep their stored value when the incoming row has none,
+# so a plain OHLCV backfill never wipes indicators written by the live path.
+MERGE_SQL = """
+INSERT INTO candles ({columns})
+SELECT {columns} FROM candles_staging
+ON CONFLICT (symbol, timeframe, datetime) DO UPDATE SET
+    {updates}
+""".format(
+    columns=', '.join(CANDLE_COLUMNS),
+    updates=',\n    '.join(
+        [f"{column} = EXCLUDED.{column}" for column in PRICE_COLUMNS]
+        + [f"{column} = COALESCE(EXCLUDED.{column}, candles.{column})" for column in INDICATOR_COLUMNS]
+    ),
+)
+
+
+def kline_rows(klines, symbol, timeframe, indicators=None):
+    """
+    Convert decoded Bybit klines into candle rows for the writers.
+
+    :param klines: A `decoding.KLINE_DTYPE` array.
+    :param symbol: The trading symbol.
+    :param timeframe: The candle timeframe.
+    :param indicators: Optional dict of indicator arrays aligned with `klines`, keyed by column.
+    :return: A list of dicts keyed by candle column.
+    """
+    return CandleBatch.from_klines(symbol, timeframe, klines, indicators).rows()
+
+
+def dedupe_rows(rows):
+    """
+    Merge rows that share a (symbol, timeframe, datetime); ON CONFLICT cannot touch a row twice per statement.
+
+    Later rows win, except that a missing indicator never overwrites one already in the batch.
+    """
+    unique = {}
+    for row in rows:
+        key = (row['symbol'], row['timeframe'], row['datetime'])
+        previous = unique.get(key)
+        if previous is not None:
+            row = {**previous, **{column: value for column, value in row.items() if value is not None or column not in INDICATOR_COLUMNS}}
+        unique[key] = row
+    return list(unique.values())
+
+
+def fetch_recent_candles(supabase, symbol, timeframe, limit, before_ms=None):
+    """
+    Load the newest stored candles of a stream (only those opening before `before_ms` when given).
+
+    :return: A list of (start_ms, open, high, low, close, volume) tuples, oldest first.
+    """
+    query = supabase.table('candles').select('datetime,open,high,low,close,volume').eq('symbol', symbol).eq('timeframe', timeframe)
+    if before_ms is not None:
+        query = query.lt('datetime', datetime.datetime.fromtimestamp(before_ms / 1000).isoformat())
+    response = query.order('datetime', desc=True).limit(limit).execute()
+    return [
+        (round(datetime.datetime.fromisoformat(row['datetime']).timestamp() * 1000), float(row['open']), float(row['high']), float(row['low']), float(row['close']), float(row['volume']))
+        for row in reversed(response.data)
+    ]
+
+
+
+def fetch_stored_timestamps(supabase, symbol, timeframe, start_ms, end_ms, page_size=1000):
+    """
+    Load the open times (epoch ms) of the stored candles of a stream in [start_ms, end_ms).
+
+    Pages through the range by `datetime` so PostgREST's row cap cannot truncate it.
+
+    :return: A sorted int64 NumPy array.
+    """
+    chunks = []
+    lower = datetime.datetime.fromtimestamp(start_ms / 1000).isoformat()
+    upper = datetime.datetime.fromtimestamp(end_ms / 1000).isoformat()
+    operator = 'gte'
+    while True:
+        query = supabase.table('candles').select('datetime').eq('symbol', symbol).eq('timeframe', timeframe)
+        response = getattr(query, operator)('datetime', lower).lt('datetime', upper).order('datetime').limit(page_size).execute()
+        if not response.data:
+            break
+        chunks.append(np.array([round(datetime.datetime.fromisoformat(row['datetime']).timestamp() * 1000) for row in response.data], dtype=np.int64))
+        if len(response.data) < page_size:
+            break
+        lower, operator = response.data[-1]['datetime'], 'gt'
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+
+def fetch_coverage(supabase, symbol=None, timeframe=None, start_ms=None, end_ms=None, page_size=1000):
+    """
+    Summarize the stored candles of the matching streams with the `candle_coverage` database function.
+
+    Returns a handful of rows per stream instead of one row per candle; see
+    candles.sql for the function itself (asyncpg users can call it directly
+    with `SELECT * FROM candle_coverage($1, $2, $3, $4)`).
+
+    :return: A list of dicts with symbol, timeframe, status ('covered' or 'missing'),
+        start_ms and end_ms (open times of the first and last candle of the range) and candles.
+    """
+    params = {
+        'p_symbol': symbol,
+        'p_timeframe': timeframe,
+        'p_start': datetime.datetime.fromtimestamp(start_ms / 1000).isoformat() if start_ms is not None else None,
+        'p_end': datetime.datetime.fromtimestamp(end_ms / 1000).isoformat() if end_ms is not None else None,
+    }
+    ranges = []
+    while True:
+        response = supabase.rpc('candle_coverage', params).range(len(ranges), len(ranges) + page_size - 1).execute()
+        ranges.extend(
+            {
+                'symbol': row['symbol'],
+                'timeframe': row['timeframe'],
+                'status': row['status'],
+                'start_ms': round(datetime.datetime.fromisoformat(row['range_start']).timestamp() * 1000),
+                'end_ms': round(datetime.datetime.fromisoformat(row['range_end']).timestamp() * 1000),
+                'candles': row['candles'],
+            }
+            for row in response.data
+        )
+        if len(response.data) < page_size:
+            return ranges
+
+class SupabaseCandleWriter:
+    """Writes candle rows through PostgREST with a single upsert per batch."""
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def _upsert(self, rows):
+        payload = [{**row, 'datetime': row['datetime'].isoformat()} for row in rows]
+        return self.supabase.table('candles').upsert(payload, on_conflict='symbol,timeframe,datetime').execute()
+
+    async def write(self, rows):
+        rows = dedupe_rows(rows)
+        # PostgREST needs every object in one request to carry the same keys
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row), []).append(row)
+        for group in groups.values():
+            # The Supabase client is synchronous, so run it off the event loop to let fetches overlap with writes
+            await asyncio.to_thread(self._upsert, group)
+        return len(rows)
+
+    async def close(self):
+        pass
+
+
+class AsyncpgCandleWriter:
+    """
+    Writes candle rows straight to Postgres over a pooled asyncpg connection.
+
+    Every batch is COPYed into a per-connection temporary staging table and merged
+    into `candles` with one INSERT ... ON CONFLICT statement.
+    """
+
+    def __init__(self, dsn, pool_size=4):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.pool = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self._lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+                logger.debug(f"Opened asyncpg pool with up to {self.pool_size} connections")
+        return self.pool
+
+    async def write(self, rows):
+        rows = dedupe_rows(rows)
+        if not rows:
+            return 0
+        records = [tuple(row.get(column) for column in CANDLE_COLUMNS) for row in rows]
+        pool = await self.connect()
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(STAGING_TABLE_SQL)
+                await connection.copy_records_to_table('candles_staging', records=records, columns=CANDLE_COLUMNS)
+                await connection.execute(MERGE_SQL)
+        return len(records)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    {columns},
+    UNIQUE (symbol, timeframe, datetime)
+)
+""".format(columns=',\n    '.join(f"{column} REAL" for column in PRICE_COLUMNS + INDICATOR_COLUMNS))
+
+SQLITE_UPSERT_SQL = """
+INSERT INTO candles ({columns}) VALUES ({placeholders})
+ON CONFLICT (symbol, timeframe, datetime) DO UPDATE SET
+    {updates}
+""".format(
+    columns=', '.join(CANDLE_COLUMNS),
+    placeholders=', '.join('?' for _ in CANDLE_COLUMNS),
+    updates=',\n    '.join(
+        [f"{column} = excluded.{column}" for column in PRICE_COLUMNS]
+        + [f"{column} = COALESCE(excluded.{column}, candles.{column})" for column in INDICATOR_COLUMNS]
+    ),
+)
+
+
+class SqliteCandleWriter:
+    """
+    Writes candle rows to a local SQLite file with the same upsert rules as Postgres.
+
+    A stand-in for the real database in benchmarks and offline runs; select it
+    with `DATABASE_URL=sqlite:///path/to/candles.db`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(SQLITE_SCHEMA)
+        self._lock = asyncio.Lock()
+
+    def _write(self, records):
+        with self.connection:
+            self.connection.executemany(SQLITE_UPSERT_SQL, records)
+
+    async def write(self, rows):
+        rows = dedupe_rows(rows)
+        if not rows:
+            return 0
+        records = [
+            tuple(row.get(column).isoformat(sep=' ') if column == 'datetime' else row.get(column) for column in CANDLE_COLUMNS)
+            for row in rows
+        ]
+        # sqlite3 connections must not be used by two threads at once
+        async with self._lock:
+            await asyncio.to_thread(self._write, records)
+        return len(records)
+
+    def timestamps(self, symbol, timeframe, start_ms, end_ms):
+        """Return the stored open times (epoch ms) of a stream in [start_ms, end_ms) as a sorted int64 array."""
+        lower = datetime.datetime.fromtimestamp(start_ms / 1000).isoformat(sep=' ')
+        upper = datetime.datetime.fromtimestamp(end_ms / 1000).isoformat(sep=' ')
+        cursor = self.connection.execute(
+            "SELECT datetime FROM candles WHERE symbol = ? AND timeframe = ? AND datetime >= ? AND datetime < ? ORDER BY datetime",
+            (symbol, timeframe, lower, upper),
+        )
+        return np.array([round(datetime.datetime.fromisoformat(value).timestamp() * 1000) for value, in cursor], dtype=np.int64)
+
+    async def close(self):
+        self.connection.close()
+
+
+class BatchingWriter:
+    """
+    Write queue in front of a candle writer.
+
+    Rows are buffered and flushed when `batch_size` rows are pending or when
+    `flush_interval` seconds have passed, whichever comes first. One batch is
+    in flight at a time while the next one fills, and `add` waits for the
+    in-flight batch when the buffer is full, which gives callers backpressure.
+    """
+
+    def __init__(self, writer, batch_size=10000, flush_interval=1.0):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._pending = []  # row dicts and CandleBatch objects, expanded when their batch is written
+        self._pending_rows = 0
+        self._pending_events = []
+        self._pending_callbacks = []
+        self._in_flight = None
+        self._timer = None
+        self._flush_lock = asyncio.Lock()
+
+    def start(self):
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._start_flush()
+
+    async def _write(self, pending, event_times, callbacks):
+        batch = []
+        for item in pending:
+            if isinstance(item, CandleBatch):
+                batch.extend(item.rows())
+            else:
+                batch.append(item)
+        try:
+            with TRACER.span('db.write'):
+                self.rows_written += await self.writer.write(batch)
+            logger.debug("Flushed {} candle rows", len(batch))
+            WRITE_BATCH_ROWS.observe(len(batch))
+            committed_ms = time.time() * 1000
+            for event_ms in event_times:
+                COMMIT_LATENCY.observe((committed_ms - event_ms) / 1000)
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} candle rows: {e}")
+            return
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in a commit callback: {e}")
+
+    async def _start_flush(self):
+        async with self._flush_lock:
+            if self._in_flight is not None:
+                await self._in_flight
+                self._in_flight = None
+            if self._pending:
+                batch, self._pending, self._pending_rows = self._pending, [], 0
+                event_times, self._pending_events = self._pending_events, []
+                callbacks, self._pending_callbacks = self._pending_callbacks, []
+                self._in_flight = asyncio.create_task(self._write(batch, event_times, callbacks))
+
+    async def add(self, rows, event_times=(), on_commit=None):
+        """
+        Buffer rows (a list of row dicts or a `candle.CandleBatch`) for the next flush.
+
+        :param event_times: Optional epoch-ms times the rows were produced at (e.g. Bybit's
+            kline timestamps), used to measure latency up to the commit.
+        :param on_commit: Optional callable run once the batch holding these rows is written.
+            It is not run when the write fails.
+        """
+        if isinstance(rows, CandleBatch):
+            self._pending.append(rows)
+        else:
+            self._pending.extend(rows)
+        self._pending_rows += len(rows)
+        self._pending_events.extend(event_times)
+        if on_commit is not None:
+            self._pending_callbacks.append(on_commit)
+        if self._pending_rows >= self.batch_size:
+            await self._start_flush()
+
+    async def flush(self):
+        """Write everything that is buffered and wait for it to land."""
+        await self._start_flush()
+        async with self._flush_lock:
+            if self._in_flight is not None:
+                await self._in_flight
+                self._in_flight = None
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        await self.flush()
+        await self.writer.close()
+
+
+def create_writer(config, supabase=None):
+    """Return the asyncpg writer when DATABASE_URL is set (SQLite for sqlite:/// URLs), otherwise fall back to PostgREST."""
+    if config.DATABASE_URL and config.DATABASE_URL.startswith('sqlite:///'):
+        return SqliteCandleWriter(config.DATABASE_URL[len('sqlite:///'):])
+    if config.DATABASE_URL:
+        return AsyncpgCandleWriter(config.DATABASE_URL, config.DB_POOL_SIZE)
+    return SupabaseCandleWriter(supabase or create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY))
@@ -0,0 +1,291 @@
+import asyncio
+import math
+from collections import deque
+from datetime import datetime
+from loguru import logger
+
+from data_fetcher import fetch_kline_range
+from decoding import kline_tuples
+from storage import fetch_recent_candles
+from timeframes import add_candles, align_open, normalize_timeframe, to_ms
+from tracing import traced
+
+# Candles used to seed the indicator state before live updates take over
+WARMUP_CANDLES = 200
+
+
+class RollingWindow:
+    """Fixed-size ring buffer of closes with a running sum and sum of squares."""
+
+    # Re-add the buffer from scratch every so often so rounding errors cannot build up
+    RESYNC_EVERY = 1000
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.reference = None
+        self.total = 0.0
+        self.total_squares = 0.0
+        self._updates = 0
+
+    def _resync(self):
+        self.total = sum(value - self.reference for value in self.values)
+        self.total_squares = sum((value - self.reference) ** 2 for value in self.values)
+
+    def _stats(self, total, total_squares, count):
+        if count < self.size:
+            return math.nan, math.nan
+        mean = total / count
+        variance = max(total_squares - total * total / count, 0.0) / (count - 1)
+        return self.reference + mean, math.sqrt(variance)
+
+    def push(self, value):
+        if self.reference is None:
+            # Work on offsets from the first value to avoid cancellation in the sum of squares
+            self.reference = value
+        if len(self.values) == self.size:
+            oldest = self.values[0] - self.reference
+            self.total -= oldest
+            self.total_squares -= oldest * oldest
+        self.values.append(value)
+        offset = value - self.reference
+        self.total += offset
+        self.total_squares += offset * offset
+        self._updates += 1
+        if self._updates % self.RESYNC_EVERY == 0:
+            self._resync()
+        return self._stats(self.total, self.total_squares, len(self.values))
+
+    def peek(self, value):
+        """Return (mean, std) as if `value` were pushed, without changing the window."""
+        if self.reference is None:
+            return self._stats(0.0, 0.0, 1)
+        total, total_squares, count = self.total, self.total_squares, len(self.values)
+        if count == self.size:
+            oldest = self.values[0] - self.reference
+            total -= oldest
+            total_squares -= oldest * oldest
+            count -= 1
+        offset = value - self.reference
+        return self._stats(total + offset, total_squares + offset * offset, count + 1)
+
+
+class RollingExtreme:
+    """Rolling max (or min) over the last `size` values using a monotonic deque."""
+
+    def __init__(self, size, is_max=True):
+        self.size = size
+        self.is_max = is_max
+        self.count = 0
+        self._deque = deque()  # (index, value), values monotonic from the front
+
+    def _beats(self, a, b):
+        return a >= b if self.is_max else a <= b
+
+    def push(self, value):
+        while self._deque and self._beats(value, self._deque[-1][1]):
+            self._deque.pop()
+        self._deque.append((self.count, value))
+        self.count += 1
+        while self._deque[0][0] <= self.count - 1 - self.size:
+            self._deque.popleft()
+        return self._deque[0][1]
+
+    def peek(self, value):
+        """Return the extreme as if `value` were pushed, without changing the window."""
+        oldest_kept = self.count + 1 - self.size
+        for index, candidate in self._deque:
+            if index >= oldest_kept:
+                return candidate if self._beats(candidate, value) else value
+        return value
+
+
+class StreamIndicatorState:
+    """
+    O(1)-per-candle indicator state for one (symbol, timeframe) stream.
+
+    Produces the same values as the functions in `indicators.py` when fed the
+    same series: TA-Lib's Wilder RSI, pandas `ewm(adjust=False)` MACD, pandas
+    rolling mean/std for SMA and Bollinger Bands, and Fibonacci levels over the
+    high/low of the last `fib_window` candles.
+    """
+
+    def __init__(self, rsi_period=14, macd_fast=12, macd_slow=26, macd_signal=9, bb_window=20, num_std_dev=2, sma_window=20, fib_window=51):
+        self.rsi_period = rsi_period
+        self.num_std_dev = num_std_dev
+        self.fast_alpha = 2 / (macd_fast + 1)
+        self.slow_alpha = 2 / (macd_slow + 1)
+        self.signal_alpha = 2 / (macd_signal + 1)
+        self.bollinger = RollingWindow(bb_window)
+        self.sma = RollingWindow(sma_window) if sma_window != bb_window else self.bollinger
+        self.highs = RollingExtreme(fib_window, is_max=True)
+        self.lows = RollingExtreme(fib_window, is_max=False)
+        self.count = 0
+        self.last_close = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.ema_fast = None
+        self.ema_slow = None
+        self.signal = None
+        self.last_start = None
+        self.last_values = None
+
+    def _rsi_step(self, close):
+        """Return (avg_gain, avg_loss, rsi) after `close`; during the seed phase the averages hold running sums."""
+        if self.last_close is None:
+            return 0.0, 0.0, math.nan
+        change = close - self.last_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        period = self.rsi_period
+        if self.count < period:
+            return self.avg_gain + gain, self.avg_loss + loss, math.nan
+        if self.count == period:
+            # TA-Lib seeds the averages with the mean of the first `period` changes
+            avg_gain = (self.avg_gain + gain) / period
+            avg_loss = (self.avg_loss + loss) / period
+        else:
+            avg_gain = (self.avg_gain * (period - 1) + gain) / period
+            avg_loss = (self.avg_loss * (period - 1) + loss) / period
+        total = avg_gain + avg_loss
+        return avg_gain, avg_loss, 100 * avg_gain / total if total != 0 else 0.0
+
+    def _ema(self, previous, value, alpha):
+        return value if previous is None else alpha * value + (1 - alpha) * previous
+
+    def _values(self, rsi, ema_fast, ema_slow, signal, bollinger, sma, high, low):
+        """Return the indicator values as a tuple in `candle.INDICATOR_COLUMNS` order."""
+        middle_band, std_dev = bollinger
+        macd_line = ema_fast - ema_slow
+        diff = high - low
+        return (
+            rsi,
+            macd_line, signal, macd_line - signal,
+            middle_band, middle_band + std_dev * self.num_std_dev, middle_band - std_dev * self.num_std_dev,
+            sma[0],
+            high, high - 0.236 * diff, high - 0.382 * diff, high - 0.5 * diff, high - 0.618 * diff, low,
+        )
+
+    def update(self, high, low, close):
+        """Add a confirmed candle to the state and return its indicator values."""
+        self.avg_gain, self.avg_loss, rsi = self._rsi_step(close)
+        self.ema_fast = self._ema(self.ema_fast, close, self.fast_alpha)
+        self.ema_slow = self._ema(self.ema_slow, close, self.slow_alpha)
+        self.signal = self._ema(self.signal, self.ema_fast - self.ema_slow, self.signal_alpha)
+        bollinger = self.bollinger.push(close)
+        sma = bollinger if self.sma is self.bollinger else self.sma.push(close)
+        highest, lowest = self.highs.push(high), self.lows.push(low)
+        self.last_close = close
+        self.count += 1
+        self.last_values = self._values(rsi, self.ema_fast, self.ema_slow, self.signal, bollinger, sma, highest, lowest)
+        return self.last_values
+
+    def peek(self, high, low, close):
+        """Return the indicator values for an in-progress candle without changing the state."""
+        _, _, rsi = self._rsi_step(close)
+        ema_fast = self._ema(self.ema_fast, close, self.fast_alpha)
+        ema_slow = self._ema(self.ema_slow, close, self.slow_alpha)
+        signal = self._ema(self.signal, ema_fast - ema_slow, self.signal_alpha)
+        bollinger = self.bollinger.peek(close)
+        sma = bollinger if self.sma is self.bollinger else self.sma.peek(close)
+        return self._values(rsi, ema_fast, ema_slow, signal, bollinger, sma, self.highs.peek(high), self.lows.peek(low))
+
+
+class StreamingIndicatorEngine:
+    """
+    Keeps a `StreamIndicatorState` per (symbol, timeframe) and fills in the indicators of live klines.
+
+    Each stream is seeded once from its memory-mapped ring buffer, the local
+    candle cache or the database (or, when all of those are missing or stale,
+    from a single REST page) and is then driven purely by WebSocket messages,
+    so the hot path never touches the network. Confirmed candles are appended
+    to the ring buffer, so a restarted process resumes without a warmup request.
+    """
+
+    def __init__(self, config, supabase=None, warmup_candles=WARMUP_CANDLES, cache=None, ring_buffers=None):
+        self.config = config
+        self.supabase = supabase
+        self.cache = cache
+        self.ring_buffers = ring_buffers
+        self.warmup_candles = warmup_candles
+        self.states = {}
+
+    def state(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.states:
+            self.states[key] = StreamIndicatorState()
+        return self.states[key]
+
+    async def _load_rest(self, session, symbol, timeframe, current_open):
+        start_ms = add_candles(current_open, timeframe, -self.warmup_candles)
+        # One request of exactly the warmup size; the cache would fetch whole pages nothing else reuses
+        klines = await fetch_kline_range(session, symbol, timeframe, start_ms, current_open - 1, self.config, limit=self.warmup_candles)
+        return kline_tuples(klines) if klines is not None else []
+
+    async def warmup(self, symbol, timeframe, session):
+        """Seed the stream's state with the closed candles that precede the current one."""
+        timeframe = normalize_timeframe(timeframe)
+        current_open = align_open(to_ms(datetime.now()), timeframe)
+
+        # Stored candles only help if they run right up to the candle that is still open
+        def is_current(candles):
+            return bool(candles) and add_candles(candles[-1][0], timeframe, 1) >= current_open
+
+        candles = []
+        sources = []
+        if self.ring_buffers is not None:
+            sources.append(('ring buffer', self.ring_buffers.recent, (symbol, timeframe, self.warmup_candles + 1)))
+        if self.cache is not None:
+            sources.append(('local cache', self.cache.recent, (symbol, timeframe, self.warmup_candles + 1)))
+        if self.supabase is not None:
+            sources.append(('database', fetch_recent_candles, (self.supabase, symbol, timeframe, self.warmup_candles + 1)))
+        source = None
+        for name, load, args in sources:
+            try:
+                candles = await asyncio.to_thread(load, *args)
+                candles = [candle for candle in candles if candle[0] < current_open][-self.warmup_candles:]
+            except Exception as e:
+                logger.warning(f"Could not load candles for {symbol} {timeframe} from the {name}: {e}")
+                candles = []
+            if is_current(candles):
+                source = name
+                break
+        if source is None:
+            try:
+                candles = await self._load_rest(session, symbol, timeframe, current_open)
+                source = 'REST API'
+            except Exception as e:
+                logger.error(f"Indicator warmup for {symbol} {timeframe} failed, starting from an empty state: {e}")
+                candles = []
+        if self.ring_buffers is not None and source != 'ring buffer':
+            # Start the ring buffer over so it only ever holds a contiguous series
+            self.ring_buffers.replace(symbol, timeframe, candles)
+
+        state = StreamIndicatorState()
+        for start, _, high, low, close, _ in candles:
+            state.update(high, low, close)
+            state.last_start = start
+        self.states[(symbol, timeframe)] = state
+        logger.debug(f"Warmed up indicators for {symbol} {timeframe} with {len(candles)} candles from the {source}")
+
+    @traced('indicators.apply')
+    def apply(self, symbol, timeframe, candle):
+        """
+        Fill the indicator fields of a `candle.Candle` in place.
+
+        Confirmed candles advance the state once (repeated confirmations of the
+        same candle are ignored); in-progress candles are evaluated without
+        changing it.
+        """
+        state = self.state(symbol, timeframe)
+        start_ms = candle.start
+        if candle.confirmed and (state.last_start is None or start_ms > state.last_start):
+            values = state.update(candle.high, candle.low, candle.close)
+            state.last_start = start_ms
+            if self.ring_buffers is not None:
+                self.ring_buffers.append(symbol, timeframe, start_ms, candle.open, candle.high, candle.low, candle.close, candle.volume)
+        elif candle.confirmed and start_ms == state.last_start and state.last_values is not None:
+            values = state.last_values
+        else:
+            values = state.peek(candle.high, candle.low, candle.close)
+        candle.set_indicators(values)
+        return candle
@@ -1,11 +1,12 @@
 import asyncio
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import calendar
 from loguru import logger
 from supabase import create_client, Client
 from rich.progress import Progress
-from data_fetcher import fetch_klines, upsert_klines
+from backfill_scheduler import BackfillScheduler
+from candle_cache import WriteThroughCacheWriter, create_candle_cache
+from gap_detection import coalesce_gaps, count_missing, find_gaps, gaps_from_coverage
+from storage import BatchingWriter, create_writer, fetch_coverage, fetch_stored_timestamps
+from timeframes import normalize_timeframe, to_ms
 import aiohttp
 from dateutil.parser import parse as parse_date
 
@@ -13,93 +14,51 @@ async def get_available_timeframes(supabase: Client, symbol: str):
     response = supabase.table('candles').select('timeframe', count='exact').eq('symbol', symbol).group('timeframe').execute()
     return [item['timeframe'] for item in response.data if item['count'] > 0]
 
-async def fill_data_gaps(supabase: Client, symbol: str, start_date: str, end_date: str, timeframes: list, config):
+async def fill_data_gaps(supabase: Client, symbol: str, start_date: str, end_date: str, timeframes: list, config, cache=None):
     logger.debug(f"Testing and filling data gaps in {symbol} from {start_date} to {end_date}")
 
-    start = parse_date(start_date)
-    end = parse_date(end_date)
+    start_ms = to_ms(parse_date(start_date))
+    end_ms = to_ms(parse_date(end_date))
 
     logger.debug(f"Processing timeframes: {timeframes}")
 
+    writer = create_writer(config, supabase)
+    if cache is not None:
+        writer = WriteThroughCacheWriter(writer, cache)
+    writer = BatchingWriter(writer, config.WRITE_BATCH_SIZE, config.LIVE_FLUSH_INTERVAL).start()
     async with aiohttp.ClientSession() as session:
-        for timeframe in timeframes:
-            logger.debug(f"Processing timeframe: {timeframe}")
-            
-            # Calculate the timedelta based on the timeframe
-            if timeframe == '1W':
-                delta = timedelta(weeks=1)
-            elif timeframe == '1M':
-                delta = relativedelta(months=1)
-            elif timeframe.isdigit():
-                delta = timedelta(minutes=int(timeframe))
-            elif timeframe.endswith('m'):
-                delta = timedelta(minutes=int(timeframe[:-1]))
-            elif timeframe.endswith('h'):
-                delta = timedelta(hours(int(timeframe[:-1])))
-            elif timeframe.endswith('d'):
-                delta = timedelta(days=int(timeframe[:-1]))
-            else:
-                logger.warning(f"Unsupported timeframe: {timeframe}")
-                continue
+        with Progress() as progress:
+            scheduler = BackfillScheduler(config, writer)
+            scheduler.progress = progress
+            # One coverage summary for all of the symbol's timeframes instead of every stored timestamp
+            try:
+                coverage = await asyncio.to_thread(fetch_coverage, supabase, symbol, None, start_ms, end_ms)
+            except Exception as e:
+                logger.warning(f"candle_coverage is not available ({e}), reading stored timestamps instead")
+                coverage = None
 
-            with Progress() as progress:
-                if isinstance(delta, relativedelta):
-                    # For monthly timeframes, estimate the total number of months
-                    total_months = (end.year - start.year) * 12 + end.month - start.month
-                    task = progress.add_task(f"[green]Checking and filling gaps in {timeframe}...", total=total_months)
+            for timeframe in map(normalize_timeframe, timeframes):
+                # The local cache answers first; the database is only asked when it has nothing
+                existing = cache.timestamps(symbol, timeframe, start_ms, end_ms - 1) if cache is not None else []
+                if len(existing):
+                    gaps = find_gaps(existing, start_ms, end_ms, timeframe)
+                elif coverage is not None:
+                    covered = [(r['start_ms'], r['end_ms']) for r in coverage if r['timeframe'] == timeframe and r['status'] == 'covered']
+                    gaps = gaps_from_coverage(covered, start_ms, end_ms, timeframe)
                 else:
-                    task = progress.add_task(f"[green]Checking and filling gaps in {timeframe}...", total=(end - start).total_seconds() / delta.total_seconds())
+                    existing = await asyncio.to_thread(fetch_stored_timestamps, supabase, symbol, timeframe, start_ms, end_ms)
+                    gaps = find_gaps(existing, start_ms, end_ms, timeframe)
 
-                # Fetch all data for the given range and timeframe
-                response = supabase.table('candles').select('datetime').eq('symbol', symbol).eq('timeframe', timeframe).gte('datetime', start.isoformat()).lte('datetime', end.isoformat()).execute()
-                
-                existing_datetimes = set(datetime.fromisoformat(item['datetime']) for item in response.data)
-
-                current = start
-                while current < end:
-                    if current not in existing_datetimes:
-                        gap_start = current
-                        while current < end and current not in existing_datetimes:
-                            if isinstance(delta, relativedelta):
-                                current += delta
-                                # Ensure we don't go past the end of the month
-                                current = current.replace(day=min(current.day, calendar.monthrange(current.year, current.month)[1]))
-                            else:
-                                current += delta
-                        
-                        logger.debug(f"Filling gap from {gap_start} to {current} for {timeframe}")
-                        klines = await fetch_klines(session, symbol, timeframe, gap_start, current, config)
-                        
-                        if klines:
-                            # Filter out existing klines before upserting
-                            new_klines = [
-                                kline for kline in klines
-                                if datetime.fromtimestamp(kline[0] / 1000) not in existing_datetimes
-                            ]
-                            if new_klines:
-                                await upsert_klines(supabase, new_klines, symbol, timeframe)
-                                logger.debug(f"Filled {len(new_klines)} new records for {timeframe} from {gap_start} to {current}")
-                                # Update existing_datetimes with new data
-                                existing_datetimes.update(datetime.fromtimestamp(kline[0] / 1000) for kline in new_klines)
-                            else:
-                                logger.debug(f"No new data to fill gap from {gap_start} to {current} for {timeframe}")
-                        else:
-                            logger.warning(f"No data available to fill gap from {gap_start} to {current} for {timeframe}")
-                    else:
-                        if isinstance(delta, relativedelta):
-                            current += delta
-                            # Ensure we don't go past the end of the month
-                            current = current.replace(day=min(current.day, calendar.monthrange(current.year, current.month)[1]))
-                        else:
-                            current += delta
-                    
-                    progress.update(task, advance=1)
-
-            logger.debug(f"Completed processing for timeframe {timeframe}")
+                windows = coalesce_gaps(gaps, timeframe)
+                logger.debug(f"Found {len(gaps)} gaps ({count_missing(gaps)} candles) in {symbol} {timeframe}, filling them with {len(windows)} requests")
+                scheduler.add_windows(symbol, timeframe, windows)
+            await scheduler.run(session)
+    await writer.close()
+    logger.debug(f"Completed gap filling for {symbol}")
 
 async def run_gap_test_and_fill(symbol: str, start_date: str, end_date: str, config, timeframes: list, log_level: str):
     logger.debug(f"Testing and filling data gaps in {symbol} from {start_date} to {end_date}")
     logger.debug(f"Processing timeframes: {timeframes}")
     
     supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
-    await fill_data_gaps(supabase, symbol, start_date, end_date, timeframes, config)
+    await fill_data_gaps(supabase, symbol, start_date, end_date, timeframes, config, create_candle_cache(config))
@@ -0,0 +1,121 @@
+import datetime
+from datetime import timedelta
+
+MINUTE_MS = 60_000
+DAY_MS = 1440 * MINUTE_MS
+WEEK_MS = 7 * DAY_MS
+# 1970-01-01 was a Thursday; Bybit weekly candles open on Monday 00:00 UTC
+WEEK_OFFSET_MS = 4 * DAY_MS
+
+# Maximum number of candles Bybit returns for one /v5/market/kline request
+MAX_KLINES_PER_REQUEST = 1000
+
+LEGACY_TIMEFRAMES = {'1W': 'W', '1M': 'M', '1d': 'D', '1D': 'D'}
+
+
+def normalize_timeframe(timeframe):
+    """
+    Map the timeframe spellings used around the project onto Bybit interval names.
+
+    :param timeframe: A timeframe such as 1, "15", "5m", "1h", "D", "1W" or "M".
+    :return: The Bybit interval ("1", "5", ..., "720", "D", "W" or "M").
+    """
+    timeframe = str(timeframe)
+    if timeframe in LEGACY_TIMEFRAMES:
+        return LEGACY_TIMEFRAMES[timeframe]
+    if timeframe.isdigit() or timeframe in ('D', 'W', 'M'):
+        return timeframe
+    if timeframe.endswith('m') and timeframe[:-1].isdigit():
+        return timeframe[:-1]
+    if timeframe.endswith('h') and timeframe[:-1].isdigit():
+        return str(int(timeframe[:-1]) * 60)
+    raise ValueError(f"Unsupported timeframe: {timeframe}")
+
+
+def get_timeframe_delta(timeframe):
+    # Accept legacy spellings such as "5m", "1h" or "1W"
+    timeframe = normalize_timeframe(timeframe)
+
+    # Calculate the timedelta based on the timeframe
+    if timeframe.isdigit():
+        delta = timedelta(minutes=int(timeframe))
+    elif timeframe == 'D':
+        delta = timedelta(days=1)
+    elif timeframe == 'W':
+        delta = timedelta(weeks=1)
+    else:
+        delta = timedelta(days=30)  # Approximation, months are handled by align_open/add_candles
+
+    return delta
+
+
+def timeframe_ms(timeframe):
+    """Return the fixed candle length in milliseconds, or None for the calendar-based "M" timeframe."""
+    timeframe = normalize_timeframe(timeframe)
+    if timeframe.isdigit():
+        return int(timeframe) * MINUTE_MS
+    if timeframe == 'D':
+        return DAY_MS
+    if timeframe == 'W':
+        return WEEK_MS
+    return None
+
+
+def to_ms(value):
+    """Convert a datetime (naive values are treated as local time, like the rest of the project) or epoch ms to epoch ms."""
+    if isinstance(value, datetime.datetime):
+        return round(value.timestamp() * 1000)
+    return int(value)
+
+
+def _month_index(ts_ms):
+    moment = datetime.datetime.fromtimestamp(ts_ms / 1000, tz=datetime.timezone.utc)
+    return moment.year * 12 + moment.month - 1
+
+
+def _month_start(month_index):
+    moment = datetime.datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return round(moment.timestamp() * 1000)
+
+
+def align_open(ts_ms, timeframe):
+    """Return the open time (epoch ms, UTC) of the candle that contains `ts_ms`."""
+    step = timeframe_ms(timeframe)
+    if step is None:
+        return _month_start(_month_index(ts_ms))
+    offset = WEEK_OFFSET_MS if step == WEEK_MS else 0
+    return (ts_ms - offset) // step * step + offset
+
+
+def add_candles(open_ms, timeframe, count):
+    """Return the open time `count` candles after the candle opening at `open_ms`."""
+    step = timeframe_ms(timeframe)
+    if step is None:
+        return _month_start(_month_index(open_ms) + count)
+    return open_ms + count * step
+
+
+def plan_kline_windows(timeframe, start_ms, end_ms, candles_per_request=MAX_KLINES_PER_REQUEST):
+    """
+    Split [start_ms, end_ms) into request windows that each hold exactly `candles_per_request` candles.
+
+    Window edges sit on candle open times, so every request except possibly the
+    last one returns a full page and consecutive windows never overlap.
+
+    :param timeframe: Bybit interval (e.g., "1", "240", "D", "W", "M").
+    :param start_ms: Start of the range in epoch ms. Rounded up to the next candle open.
+    :param end_ms: End of the range in epoch ms (exclusive).
+    :param candles_per_request: Candles per window, capped at Bybit's page size.
+    :return: A list of (window_start_ms, window_end_ms) tuples, end inclusive as Bybit expects.
+    """
+    candles_per_request = max(1, min(candles_per_request, MAX_KLINES_PER_REQUEST))
+    current = align_open(start_ms, timeframe)
+    if current < start_ms:
+        current = add_candles(current, timeframe, 1)
+
+    windows = []
+    while current < end_ms:
+        next_start = min(add_candles(current, timeframe, candles_per_request), end_ms)
+        windows.append((current, next_start - 1))
+        current = next_start
+    return windows
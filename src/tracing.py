@@ -0,0 +1,180 @@
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import signal
+import time
+from collections import deque
+import numpy as np
+from loguru import logger
+
+from metrics import REGISTRY
+
+SPAN_SECONDS = REGISTRY.histogram('span_duration_seconds', 'Duration of traced sections', [0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5], ['span'])
+
+
+class Span:
+    """Times one section of code; works with both `with` and `async with`."""
+
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+class Tracer:
+    """
+    Lightweight timers for the hot sections of the reader.
+
+    Every span feeds the `span_duration_seconds` histogram of the metrics
+    registry and a bounded sample of recent durations for percentiles. While
+    a trace is recording, spans are also kept as Chrome trace events
+    (chrome://tracing, Perfetto or speedscope).
+    """
+
+    def __init__(self, samples=4096, max_events=1_000_000):
+        self.samples = samples
+        self.max_events = max_events
+        self.durations = {}
+        self.counts = {}
+        self.events = None
+        self._origin = time.perf_counter()
+
+    def span(self, name):
+        return Span(self, name)
+
+    def traced(self, name=None):
+        """Decorator that wraps a function (sync or async) in a span named after it."""
+        def decorate(func):
+            span_name = name or func.__qualname__
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    async with Span(self, span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with Span(self, span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record(self, name, start, duration):
+        samples = self.durations.get(name)
+        if samples is None:
+            samples = self.durations[name] = deque(maxlen=self.samples)
+        samples.append(duration)
+        self.counts[name] = self.counts.get(name, 0) + 1
+        SPAN_SECONDS.observe(duration, span=name)
+        if self.events is not None and len(self.events) < self.max_events:
+            task = asyncio.current_task() if _loop_running() else None
+            self.events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': duration * 1e6,
+                'pid': os.getpid(),
+                'tid': id(task) if task is not None else 0,
+            })
+
+    def percentiles(self, name, quantiles=(50, 90, 99)):
+        """Return {quantile: seconds} over the recent samples of a span, plus 'max'."""
+        samples = np.fromiter(self.durations.get(name, ()), dtype=float)
+        if not len(samples):
+            return {}
+        values = dict(zip(quantiles, np.percentile(samples, quantiles).tolist()))
+        values['max'] = float(samples.max())
+        return values
+
+    def summary(self):
+        """Return a text table with the count and latency percentiles (ms) of every span."""
+        lines = [f"{'span':<40} {'count':>10} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}"]
+        for name in sorted(self.durations):
+            p = self.percentiles(name)
+            lines.append(f"{name:<40} {self.counts[name]:>10} {p[50] * 1000:>10.3f} {p[90] * 1000:>10.3f} {p[99] * 1000:>10.3f} {p['max'] * 1000:>10.3f}")
+        return '\n'.join(lines)
+
+    def start_trace(self):
+        self.events = []
+
+    def write_trace(self, path):
+        """Write the recorded spans as a Chrome trace file and stop recording."""
+        events, self.events = self.events or [], None
+        with open(path, 'w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+        logger.info(f"Wrote {len(events)} trace events to {path}")
+
+
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+TRACER = Tracer()
+traced = TRACER.traced
+
+
+async def log_summaries(interval, tracer=TRACER):
+    """Log the span summary every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Timing summary:\n{tracer.summary()}")
+
+
+class ProfileSwitch:
+    """
+    Toggles cProfile on the running event loop with a signal (SIGUSR1 by default).
+
+    The first signal starts profiling, the next one stops it, writes the stats
+    to `<directory>/profile-<time>.prof` (readable with snakeviz or pstats) and
+    logs the top functions.
+    """
+
+    def __init__(self, directory='.', signum=getattr(signal, 'SIGUSR1', None)):
+        self.directory = directory
+        self.signum = signum
+        self.profiler = None
+
+    def install(self, loop=None):
+        if self.signum is None:
+            logger.warning("Signals are not available on this platform, profiling switch disabled")
+            return self
+        (loop or asyncio.get_event_loop()).add_signal_handler(self.signum, self.toggle)
+        return self
+
+    def toggle(self):
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            logger.info("Profiling started")
+            return
+        self.profiler.disable()
+        path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        self.profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats(20)
+        self.profiler = None
+        logger.info(f"Profiling stopped, stats written to {path}\n{report.getvalue()}")
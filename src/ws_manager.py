@@ -0,0 +1,172 @@
+import asyncio
+import json
+import random
+import websockets
+from loguru import logger
+
+from metrics import WS_RECONNECTS
+
+
+def kline_topic(symbol, timeframe):
+    return f"kline.{timeframe}.{symbol}"
+
+
+def parse_topic(topic):
+    """Split a kline topic ("kline.<timeframe>.<symbol>") into (symbol, timeframe)."""
+    _, timeframe, symbol = topic.split('.', 2)
+    return symbol, timeframe
+
+
+class KlineConnection:
+    """
+    One Bybit WebSocket carrying a fixed set of topics.
+
+    The reader task puts every raw message on the shared queue as soon as it
+    arrives and reconnects (and resubscribes) only this socket when it fails
+    or goes quiet. Reconnects back off exponentially from `reconnect_delay` up
+    to `max_reconnect_delay` with full jitter, so sockets that drop together do
+    not reconnect together. After a reconnect, `on_reconnect(topics)` runs while
+    new messages are held back, and they are released once it is done.
+    """
+
+    def __init__(self, name, url, topics, queue, args_per_subscribe=10, ping_interval=20, reconnect_delay=1.0, max_reconnect_delay=60.0, on_reconnect=None):
+        self.name = name
+        self.url = url
+        self.topics = topics
+        self.queue = queue
+        self.args_per_subscribe = args_per_subscribe
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.on_reconnect = on_reconnect
+        self.reconnects = 0
+        # Failed attempts since the socket last delivered a kline; acks and pongs do not count
+        self.failures = 0
+        self.ws = None
+
+    async def _subscribe(self, ws):
+        for i in range(0, len(self.topics), self.args_per_subscribe):
+            args = self.topics[i:i + self.args_per_subscribe]
+            await ws.send(json.dumps({"req_id": f"{self.name}-{i}", "op": "subscribe", "args": args}))
+        logger.debug(f"{self.name}: subscribed to {len(self.topics)} topics")
+
+    async def _ping(self, ws):
+        # Bybit drops connections that stay silent, so send its application-level ping
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send(json.dumps({"op": "ping"}))
+
+    def backoff(self):
+        """Seconds to wait before the next attempt: a random share of the exponentially growing cap."""
+        return random.uniform(0, min(self.max_reconnect_delay, self.reconnect_delay * 2 ** self.failures))
+
+    def _received(self, message):
+        # Only topic (kline) frames show the connection is usable; an ack alone may precede another drop
+        if self.failures and '"topic"' in message:
+            self.failures = 0
+
+    async def _read(self, ws, catch_up=None):
+        # Pongs arrive at least every ping interval, so a longer silence means the socket is dead
+        timeout = self.ping_interval * 2
+        held = []
+        while catch_up is not None and not catch_up.done():
+            # Live messages wait until the missed candles are in the pipeline ahead of them
+            receive = asyncio.ensure_future(ws.recv())
+            done, _ = await asyncio.wait({receive, catch_up}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                held.append(receive.result())
+                self._received(held[-1])
+                continue
+            receive.cancel()
+            if not done:
+                raise asyncio.TimeoutError
+        if catch_up is not None and catch_up.exception() is not None:
+            logger.error(f"{self.name}: catch-up failed: {catch_up.exception()}")
+        for message in held:
+            await self.queue.put(message)
+
+        while True:
+            message = await asyncio.wait_for(ws.recv(), timeout=timeout)
+            self._received(message)
+            await self.queue.put(message)
+
+    async def run(self):
+        while True:
+            pinger = None
+            catch_up = None
+            try:
+                async with websockets.connect(self.url) as ws:
+                    self.ws = ws
+                    logger.debug(f"{self.name}: connected to {self.url}")
+                    await self._subscribe(ws)
+                    pinger = asyncio.create_task(self._ping(ws))
+                    if self.reconnects and self.on_reconnect is not None:
+                        catch_up = asyncio.create_task(self.on_reconnect(self.topics))
+                    await self._read(ws, catch_up)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"{self.name}: no messages for {self.ping_interval * 2}s, reconnecting")
+            except Exception as e:
+                logger.error(f"{self.name}: WebSocket error, reconnecting: {e}")
+            finally:
+                self.ws = None
+                if pinger is not None:
+                    pinger.cancel()
+                if catch_up is not None and not catch_up.done():
+                    # The next reconnect catches up from wherever this one got to
+                    catch_up.cancel()
+            self.reconnects += 1
+            WS_RECONNECTS.inc(connection=self.name)
+            delay = self.backoff()
+            self.failures += 1
+            logger.debug(f"{self.name}: reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class WebSocketManager:
+    """
+    Packs kline topics onto as few sockets as possible and merges their messages into one queue.
+
+    Every socket has its own reader task, so a quiet or broken socket never
+    delays the others, and consumers read `queue` in arrival order.
+    """
+
+    def __init__(self, url, topics, topics_per_connection=200, args_per_subscribe=10, ping_interval=20, queue_size=10000, reconnect_delay=1.0, max_reconnect_delay=60.0):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.connections = [
+            KlineConnection(f"ws-{n}", url, topics[i:i + topics_per_connection], self.queue, args_per_subscribe, ping_interval, reconnect_delay, max_reconnect_delay)
+            for n, i in enumerate(range(0, len(topics), topics_per_connection))
+        ]
+        self.tasks = []
+
+    @classmethod
+    def for_streams(cls, config, symbols, timeframes):
+        topics = [kline_topic(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+        return cls(
+            config.BYBIT_WS_URL, topics, config.WS_TOPICS_PER_CONNECTION, config.WS_ARGS_PER_SUBSCRIBE, config.WS_PING_INTERVAL,
+            config.WS_QUEUE_SIZE, config.WS_RECONNECT_DELAY, config.WS_MAX_RECONNECT_DELAY,
+        )
+
+    def start(self, on_reconnect=None):
+        """
+        Start the socket readers.
+
+        :param on_reconnect: Optional coroutine function called with a socket's topics whenever it
+            reconnects (e.g. a `catch_up.StreamCatchUp`); that socket's messages are held until it returns.
+        """
+        for connection in self.connections:
+            connection.on_reconnect = on_reconnect
+        self.tasks = [asyncio.create_task(connection.run()) for connection in self.connections]
+        logger.debug(f"Started {len(self.connections)} WebSocket connections")
+        return self
+
+    @property
+    def reconnects(self):
+        return sum(connection.reconnects for connection in self.connections)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []